@@ -22,3 +22,8 @@ def probe_response():
     with open(curdir + "/data/probe_response.xml", "rb") as resp:
         canned = resp.read()
     return (canned, DISCOVER_IP)
+
+
+def relateTo(data, messageId):
+    "make a canned match message relate to the message with the given MessageID"
+    return data.replace(b"urn:uuid:2de9f5ad-abd2-4c0e-9ba8-178098d67f01", messageId.encode("UTF-8"))
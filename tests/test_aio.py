@@ -0,0 +1,83 @@
+import asyncio
+import time
+from .fixtures import probe_response, relateTo
+from wsdiscovery.actions import constructProbeMatch
+from wsdiscovery.service import Service
+from wsdiscovery.transport import MULTICAST_PORT
+from wsdiscovery.aio import AsyncWSDiscovery
+
+
+def test_async_probing(probe_response):
+    "feed a canned Probe response to the asyncio networking engine"
+
+    data, ipAddr = probe_response
+
+    async def search():
+        wsd = AsyncWSDiscovery()
+        await wsd.start()
+        loop = asyncio.get_event_loop()
+
+        def respond():
+            "answer the probe sent by the search"
+            probeId, context = next(iter(wsd._searches.items()))
+            wsd._networkingEngine._handleDatagram(relateTo(data, probeId), (ipAddr, MULTICAST_PORT))
+
+        loop.call_later(0.1, respond)
+        found = await wsd.searchServices(timeout=0.5)
+        await wsd.stop()
+        return found
+
+    loop = asyncio.new_event_loop()
+    try:
+        found = loop.run_until_complete(search())
+    finally:
+        loop.close()
+
+    assert len(found) == 1
+    assert ipAddr in found[0].getXAddrs()[0]
+    assert len(found[0].getScopes()) == 4
+
+
+def _iterate(maxResults=None, idleTimeout=None, delays=(0.05, 0.1, 0.15)):
+    "collect the services of an iterServices search answered after the DELAYS"
+
+    async def search():
+        wsd = AsyncWSDiscovery()
+        wsd.sendMulticastMessage = lambda env, initialDelay=0: None
+        loop = asyncio.get_event_loop()
+        services = wsd.iterServices(timeout=5, maxResults=maxResults, idleTimeout=idleTimeout)
+        probeId, context = next(iter(wsd._searches.items()))
+
+        for i, delay in enumerate(delays):
+            device = Service([], [], ["http://10.0.0.%i/" % i], "urn:uuid:%i" % i, 0)
+            env = constructProbeMatch([device], probeId)
+            loop.call_later(delay, wsd.envReceived, env, ("10.0.0.%i" % i, MULTICAST_PORT))
+
+        found = []
+        async for service in services:
+            found.append(service.getEPR())
+        return found, wsd._searches, context.complete
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(search())
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def test_async_iter_services_stops_after_max_results():
+    found, searches, complete = _iterate(maxResults=2)
+    assert found == ["urn:uuid:0", "urn:uuid:1"]
+    assert not searches
+    assert not complete  # not to be cached as a complete proxy answer
+
+
+def test_async_iter_services_stops_when_idle():
+    start = time.monotonic()
+    found, searches, complete = _iterate(idleTimeout=0.2, delays=(0.05, 0.1))
+    assert found == ["urn:uuid:0", "urn:uuid:1"]
+    assert time.monotonic() - start < 1
+    assert not searches
+    assert not complete
@@ -0,0 +1,53 @@
+import socket
+
+import pytest
+
+from wsdiscovery.batchio import PortableBatchIO, createBatchIO, _packSockaddr, _unpackSockaddr
+
+
+@pytest.fixture(params=["portable", "best"])
+def batchIO(request):
+    return PortableBatchIO() if request.param == "portable" else createBatchIO()
+
+
+@pytest.fixture
+def sockets():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(("127.0.0.1", 0))
+    rx.setblocking(0)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    yield rx, tx
+    rx.close()
+    tx.close()
+
+
+def test_batches_are_sent_and_received(batchIO, sockets):
+    rx, tx = sockets
+    datagrams = [(b"message %i" % i, rx.getsockname(), None) for i in range(40)]
+
+    assert batchIO.sendBatch(tx, datagrams) == []
+    received = batchIO.recvBatch(rx, 100)
+
+    assert [data for data, addr, ancdata in received] == [data for data, addr, ancdata in datagrams]
+    assert received[0][1] == ("127.0.0.1", tx.getsockname()[1])
+    stats = batchIO.getStats()
+    assert stats["sentDatagrams"] == stats["receivedDatagrams"] == 40
+    if stats["implementation"] == "mmsg":
+        assert stats["sendCalls"] + stats["recvCalls"] < 10
+
+
+def test_failed_datagrams_are_reported(batchIO, sockets):
+    rx, tx = sockets
+    datagrams = [(b"a", rx.getsockname(), None),
+                 (b"b", ("255.255.255.255", 9), None),  # broadcast is not enabled
+                 (b"c", rx.getsockname(), None)]
+
+    failed = batchIO.sendBatch(tx, datagrams)
+
+    assert [index for index, error in failed] == [1]
+    assert [data for data, addr, ancdata in batchIO.recvBatch(rx, 10)] == [b"a", b"c"]
+
+
+def test_ipv6_addresses_are_unpacked_like_recvfrom_gives_them():
+    name = _packSockaddr(socket.AF_INET6, ("fe80::1%2", 3702))
+    assert _unpackSockaddr(name) == ("fe80::1", 3702, 0, 2)
@@ -0,0 +1,36 @@
+from wsdiscovery.cache import ExpiringCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl():
+    timer = FakeTimer()
+    cache = ExpiringCache(10, 5, timer=timer)
+
+    assert cache.add("a")
+    assert not cache.add("a")
+    timer.now = 4.9
+    assert "a" in cache
+    timer.now = 5.0
+    assert "a" not in cache
+    assert cache.add("a")
+    assert cache.getStats()["expirations"] == 1
+
+
+def test_oldest_entries_are_evicted_at_capacity():
+    cache = ExpiringCache(2, 60, timer=FakeTimer())
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.set("a", 3)  # refreshes "a", so "b" is now the oldest
+    cache.set("c", 4)
+
+    assert len(cache) == 2
+    assert cache.get("b") is None
+    assert cache.get("a") == 3
+    assert cache.getStats()["evictions"] == 1
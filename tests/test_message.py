@@ -0,0 +1,57 @@
+from .fixtures import probe_response
+from wsdiscovery.actions import constructHello, constructProbe, NS_ACTION_PROBE_MATCH
+from wsdiscovery.message import createSOAPMessage, parseSOAPMessage
+from wsdiscovery.service import Service
+from wsdiscovery import QName, Scope
+
+
+def test_parse_probe_response(probe_response):
+    data, ipAddr = probe_response
+    env = parseSOAPMessage(data, ipAddr)
+
+    assert env.getAction() == NS_ACTION_PROBE_MATCH
+    assert env.getRelatesTo() == "urn:uuid:2de9f5ad-abd2-4c0e-9ba8-178098d67f01"
+    match, = env.getProbeResolveMatches()
+    assert match.getEPR() == "urn:uuid:2419d68a-2dd2-21b2-a205-78A5DD0F9593"
+    assert match.getXAddrs() == ["http://192.168.1.104:80/onvif/device_service"]
+    assert len(match.getScopes()) == 4
+
+
+def test_hello_roundtrip():
+    ttype = QName("http://www.onvif.org/ver10/device/wsdl", "Device")
+    service = Service([ttype], [Scope("onvif://www.onvif.org/Model")],
+                      ["http://10.0.0.1:8080/abc"], "urn:uuid:1234", 42)
+    env = parseSOAPMessage(createSOAPMessage(constructHello(service)).encode("UTF-8"), "10.0.0.1")
+
+    assert env.getEPR() == "urn:uuid:1234"
+    assert env.getInstanceId() == "42"
+    assert [t.getFullname() for t in env.getTypes()] == [ttype.getFullname()]
+    assert [s.getValue() for s in env.getScopes()] == ["onvif://www.onvif.org/Model"]
+    assert env.getXAddrs() == ["http://10.0.0.1:8080/abc"]
+
+
+def test_colliding_prefixes_and_special_characters_roundtrip():
+    types = [QName("http://example.com/a", "A", "d"),    # the WS-Discovery prefix
+             QName("http://example.com/b", "B", "p"),
+             QName("http://example.com/c", "C", "p"),    # same prefix, other namespace
+             QName("http://example.com/d?x=1&y=<2>", "D"),
+             QName("http://example.com/b", "E", "p")]
+    scopes = [Scope("http://example.com/a&b<c>\"d\"")]
+    xAddrs = ["http://10.0.0.1/?a=1&b=2"]
+    service = Service(types, scopes, xAddrs, "urn:uuid:<&>", 1)
+
+    for sent in (constructHello(service), constructProbe(types, scopes)):
+        env = parseSOAPMessage(createSOAPMessage(sent).encode("UTF-8"), "10.0.0.1")
+        assert [t.getFullname() for t in env.getTypes()] == [t.getFullname() for t in types]
+        assert [s.getValue() for s in env.getScopes()] == [scopes[0].getValue()]
+        assert env.getXAddrs() == sent.getXAddrs()
+        assert env.getEPR() == sent.getEPR()
+
+
+def test_fault_and_garbage_are_ignored():
+    fault = b'<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope">' \
+            b'<s:Body><s:Fault/></s:Body></s:Envelope>'
+    assert parseSOAPMessage(fault, "10.0.0.1") is None
+    assert parseSOAPMessage(b"not xml", "10.0.0.1") is None
+    assert parseSOAPMessage(b'<?xml version="1.0" encoding="x-bogus"?><a/>', "10.0.0.1") is None
+    assert parseSOAPMessage(b"\xff\xfe garbage", "10.0.0.1") is None
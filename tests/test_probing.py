@@ -1,7 +1,7 @@
 import logging
 import selectors
 import socket
-from .fixtures import probe_response
+from .fixtures import probe_response, relateTo
 from wsdiscovery.threaded import NetworkingThread, MULTICAST_PORT
 from wsdiscovery import WSDiscovery
 
@@ -10,6 +10,7 @@ def test_probing(monkeypatch, probe_response):
     "mock up socket registration, event selection & socket message response"
 
     sck = None
+    wsd = None
 
     def mock_register(selector, rsock, evtmask):
         """get hold of the multicast socket that will send the Probe message,
@@ -21,22 +22,30 @@ def test_probing(monkeypatch, probe_response):
             sck = rsock
 
     def mock_select(*args):
-        "set a mock Probe response event in motion for the same socket"
+        "set a mock Probe response event in motion for the same socket, once the Probe is sent"
         global sck
-        if sck and sck.getsockname()[1] == MULTICAST_PORT:
-            key = selectors.SelectorKey(sck.makefile(), sck.fileno(), [], "")
+        if sck and sck.getsockname()[1] == MULTICAST_PORT and wsd._searches:
+            key = selectors.SelectorKey(sck, sck.fileno(), selectors.EVENT_READ, None)
             # to mock just one response we just nullify the sock
             sck = None
             return [(key, selectors.EVENT_READ)]
         else:
             return []
 
-    def mock_recvfrom(*args):
-        return probe_response
+    responses = [probe_response]
+
+    def mock_recvfrom_into(rsock, buf, *args):
+        "fill in the response once, then behave like a drained socket"
+        if not responses:
+            raise BlockingIOError()
+        data, addr = responses.pop()
+        data = relateTo(data, next(iter(wsd._searches)))
+        buf[:len(data)] = data
+        return len(data), (addr, MULTICAST_PORT)
 
     monkeypatch.setattr(selectors.DefaultSelector, "register", mock_register)
     monkeypatch.setattr(selectors.DefaultSelector, "select", mock_select)
-    monkeypatch.setattr(socket.socket, "recvfrom", mock_recvfrom)
+    monkeypatch.setattr(socket.socket, "recvfrom_into", mock_recvfrom_into)
 
     # we cannot use a fixture that'd start discovery for us, since the socket
     # selector registration happens at startup time
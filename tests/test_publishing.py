@@ -0,0 +1,90 @@
+from wsdiscovery import QName
+from wsdiscovery.actions import constructProbe, constructResolve, NS_ACTION_HELLO, NS_ACTION_BYE, \
+                               NS_ACTION_PROBE_MATCH, NS_ACTION_RESOLVE_MATCH
+from wsdiscovery.daemon import Daemon, MAX_PROBE_MATCHES_PER_MESSAGE
+from wsdiscovery.publishing import Publishing
+
+
+PRINTER = QName("http://example.com", "Printer")
+CAMERA = QName("http://example.com", "Camera")
+
+
+class FakeNetworking:
+    "record sent messages instead of sending them"
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        super().__init__(**kwargs)
+
+    def sendMulticastMessage(self, env, initialDelay=0):
+        self.sent.append(env)
+
+    def sendUnicastMessage(self, env, host, port, initialDelay=0):
+        self.sent.append(env)
+
+
+class FakePublishing(Publishing, Daemon, FakeNetworking):
+    _serverStarted = True
+
+
+def _actions(envs):
+    return [env.getAction() for env in envs]
+
+
+def test_services_are_published_with_their_own_eprs():
+    wsp = FakePublishing()
+    wsp.publishService([PRINTER], [], ["http://10.0.0.1/printer"], "urn:uuid:printer")
+    wsp.publishService([CAMERA], [], ["http://10.0.0.1/camera"], "urn:uuid:camera")
+
+    assert _actions(wsp.sent) == [NS_ACTION_HELLO, NS_ACTION_HELLO]
+    assert [env.getEPR() for env in wsp.sent] == ["urn:uuid:printer", "urn:uuid:camera"]
+    assert sorted(wsp._localServices) == ["urn:uuid:camera", "urn:uuid:printer"]
+
+
+def test_unpublished_service_says_bye_and_is_removed():
+    wsp = FakePublishing()
+    wsp.publishService([PRINTER], [], [], "urn:uuid:printer")
+    wsp.publishService([CAMERA], [], [], "urn:uuid:camera")
+    wsp.sent = []
+
+    wsp.unpublishService("urn:uuid:printer")
+    wsp.unpublishService("urn:uuid:unknown")
+
+    assert _actions(wsp.sent) == [NS_ACTION_BYE]
+    assert wsp.sent[0].getEPR() == "urn:uuid:printer"
+    assert list(wsp._localServices) == ["urn:uuid:camera"]
+
+    wsp._handle_resolve(constructResolve("urn:uuid:printer"), ("10.0.0.9", 3702))
+    assert len(wsp.sent) == 1
+
+
+def test_probes_are_answered_from_the_index():
+    wsp = FakePublishing()
+    wsp.publishService([PRINTER], [], [], "urn:uuid:printer")
+    wsp.publishService([CAMERA], [], [], "urn:uuid:camera")
+    wsp.sent = []
+
+    wsp._handle_probe(constructProbe([CAMERA], []), ("10.0.0.9", 3702))
+
+    assert _actions(wsp.sent) == [NS_ACTION_PROBE_MATCH]
+    assert [m.getEPR() for m in wsp.sent[0].getProbeResolveMatches()] == ["urn:uuid:camera"]
+
+    wsp._handle_resolve(constructResolve("urn:uuid:printer"), ("10.0.0.9", 3702))
+    assert _actions(wsp.sent[1:]) == [NS_ACTION_RESOLVE_MATCH]
+
+
+def test_large_probe_responses_are_split():
+    wsp = FakePublishing()
+    count = MAX_PROBE_MATCHES_PER_MESSAGE * 2 + 1
+    for i in range(count):
+        wsp.publishService([PRINTER], [], [], "urn:uuid:%i" % i)
+    wsp.sent = []
+
+    wsp._handle_probe(constructProbe([PRINTER], []), ("10.0.0.9", 3702))
+
+    sizes = [len(env.getProbeResolveMatches()) for env in wsp.sent]
+    assert sizes == [MAX_PROBE_MATCHES_PER_MESSAGE, MAX_PROBE_MATCHES_PER_MESSAGE, 1]
+    eprs = {m.getEPR() for env in wsp.sent for m in env.getProbeResolveMatches()}
+    assert len(eprs) == count
+    assert len({env.getMessageId() for env in wsp.sent}) == 3
+    assert {env.getRelatesTo() for env in wsp.sent} == {wsp.sent[0].getRelatesTo()}
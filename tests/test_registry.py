@@ -0,0 +1,64 @@
+import random
+from wsdiscovery.registry import ServiceRegistry
+from wsdiscovery.service import Service
+from wsdiscovery.util import filterServices, MATCH_BY_STRCMP
+from wsdiscovery import QName, Scope
+
+
+TYPES = [QName("http://www.onvif.org/ver10/network/wsdl", "NetworkVideoTransmitter"),
+         QName("http://www.onvif.org/ver10/device/wsdl", "Device"),
+         QName("http://example.com/printers", "Printer")]
+
+SCOPES = ["onvif://www.onvif.org/Profile/Streaming",
+          "onvif://www.onvif.org/Profile/",
+          "onvif://www.onvif.org/location/country/china",
+          "onvif://www.onvif.org/location/country",
+          "onvif://www.onvif.org/location",
+          "ONVIF://www.onvif.org/name/IPCAM",
+          "http://user@Example.com/a/b",
+          "http://user@example.com/a/bc",
+          "ldap:///ou=engineering,o=examplecom,c=us"]
+
+
+def test_search_matches_filtering_all_services():
+    rnd = random.Random(42)
+    registry = ServiceRegistry()
+    services = []
+    for i in range(200):
+        service = Service(rnd.sample(TYPES, rnd.randint(0, 2)),
+                          [Scope(s) for s in rnd.sample(SCOPES, rnd.randint(0, 3))],
+                          [], "urn:uuid:%i" % i, 0)
+        services.append(service)
+        registry.add(service)
+
+    for service in services[:50]:
+        registry.remove(service.getEPR())
+    services = services[50:]
+
+    queries = [([], []), (TYPES[:1], []), (TYPES[:2], []), ([], [Scope(SCOPES[4])])]
+    for value in SCOPES:
+        queries.append((TYPES[:1], [Scope(value)]))
+        queries.append(([], [Scope(value), Scope(SCOPES[1])]))
+        queries.append(([], [Scope(value, MATCH_BY_STRCMP)]))
+
+    for types, scopes in queries:
+        expected = filterServices(services, types, scopes)
+        found = registry.search(types, scopes)
+        assert sorted(s.getEPR() for s in found) == sorted(s.getEPR() for s in expected)
+
+    assert len(registry) == 150
+
+
+def test_silent_services_expire():
+    now = [0]
+    registry = ServiceRegistry(timer=lambda: now[0])
+    for i in range(3):
+        registry.add(Service([], [], [], "urn:uuid:%i" % i, 0))
+        now[0] += 10
+    registry.touch("urn:uuid:0")
+
+    expired = registry.expire(maxAge=15)
+
+    assert [s.getEPR() for s in expired] == ["urn:uuid:1"]
+    assert sorted(registry) == ["urn:uuid:0", "urn:uuid:2"]
+    assert registry.getLastSeen("urn:uuid:0") == 30
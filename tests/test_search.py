@@ -0,0 +1,239 @@
+import threading
+
+import pytest
+
+from wsdiscovery import QName
+from wsdiscovery.actions import constructProbeMatch, constructResolveMatch, constructBye, \
+                               constructHello, NS_ACTION_PROBE, NS_ACTION_RESOLVE
+from wsdiscovery.daemon import Daemon
+from wsdiscovery.discovery import Discovery
+from wsdiscovery.namespaces import NS_DISCOVERY
+from wsdiscovery.search import SearchContext, expandTargets
+from wsdiscovery.service import Service
+
+
+def test_search_context_wakes_up_waiting_consumer():
+    ttype = QName("http://www.onvif.org/ver10/device/wsdl", "Device")
+    search = SearchContext("urn:uuid:probe", [ttype])
+    other = Service([QName("http://example.com", "Printer")], [], [], "urn:uuid:1", 0)
+    device = Service([ttype], [], [], "urn:uuid:2", 0)
+
+    timer = threading.Timer(0.05, lambda: (search.add(other), search.add(device)))
+    timer.start()
+    found = search.wait(0, 5)
+    timer.join()
+
+    assert found == [device]
+    assert not search.add(device)
+    assert search.wait(1, 0) == [device]
+
+
+class FakeNetworking:
+    "record sent messages instead of sending them"
+
+    def __init__(self, **kwargs):
+        self.sent = []
+        super().__init__(**kwargs)
+
+    def sendMulticastMessage(self, env, initialDelay=0):
+        self.sent.append(env)
+
+    def sendUnicastMessage(self, env, host, port, initialDelay=0):
+        self.sent.append(env)
+
+
+class FakeDiscovery(Daemon, Discovery, FakeNetworking):
+    pass
+
+
+class FakeDaemon(Daemon, FakeNetworking):
+    pass
+
+
+def test_matches_go_to_the_search_they_relate_to():
+    wsd = FakeDiscovery()
+    first = wsd._startSearch(None, None, None, None)
+    second = wsd._startSearch(None, None, None, None)
+
+    device = Service([], [], ["http://10.0.0.1/"], "urn:uuid:1", 0)
+    wsd.envReceived(constructProbeMatch([device], first.messageId), ("10.0.0.1", 3702))
+    # without addresses, the match is resolved on behalf of the search
+    nameless = Service([], [], [], "urn:uuid:2", 0)
+    wsd.envReceived(constructProbeMatch([nameless], second.messageId), ("10.0.0.2", 3702))
+    resolve = wsd.sent[-1]
+    nameless.setXAddrs(["http://10.0.0.2/"])
+    wsd.envReceived(constructResolveMatch(nameless, resolve.getMessageId()), ("10.0.0.2", 3702))
+
+    assert [s.getEPR() for s in first.getServices()] == ["urn:uuid:1"]
+    assert [s.getXAddrs() for s in second.getServices()] == [["http://10.0.0.2/"]]
+
+    wsd._endSearch(second)
+    assert list(wsd._searches) == [first.messageId]
+
+
+def test_remote_services_are_queried_by_type():
+    wsd = FakeDiscovery()
+    ttype = QName("http://www.onvif.org/ver10/device/wsdl", "Device")
+    device = Service([ttype], [], ["http://10.0.0.1/"], "urn:uuid:1", 0)
+    other = Service([QName("http://example.com", "Printer")], [], ["http://10.0.0.2/"], "urn:uuid:2", 0)
+    wsd.envReceived(constructHello(device), ("10.0.0.1", 3702))
+    wsd.envReceived(constructHello(other), ("10.0.0.2", 3702))
+
+    assert [s.getEPR() for s in wsd.getRemoteServices([ttype])] == ["urn:uuid:1"]
+    assert len(wsd.getRemoteServices()) == 2
+
+
+def test_expand_targets():
+    assert expandTargets("10.0.0.0/30") == ["10.0.0.1", "10.0.0.2"]
+    assert expandTargets(["10.0.0.7", "10.0.1.1/32", "camera.local"]) == \
+        ["10.0.0.7", "10.0.1.1", "camera.local"]
+
+
+def test_directed_probes_are_rate_limited_and_timed():
+    wsd = FakeDiscovery()
+    wsd.sendUnicastMessage = lambda env, host, port, initialDelay=0: wsd.sent.append((host, initialDelay))
+
+    searches = {}
+    assert list(wsd._startTargetSearches("10.0.0.0/29", None, None, 3702, 100, searches)) == []
+    assert [host for host, delay in wsd.sent] == ["10.0.0.%d" % (i + 1) for i in range(6)]
+    assert all(abs(delay - i * 10) <= 1 for i, (host, delay) in enumerate(wsd.sent))
+
+    device = Service([], [], ["http://10.0.0.2/"], "urn:uuid:1", 0)
+    wsd.envReceived(constructProbeMatch([device], searches["10.0.0.2"].messageId), ("10.0.0.2", 3702))
+    wsd._endSearches(searches)
+
+    assert searches["10.0.0.2"].getLatency() is not None
+    assert [s.getEPR() for s in searches["10.0.0.2"].getServices()] == ["urn:uuid:1"]
+    assert searches["10.0.0.1"].getLatency() is None
+    assert wsd._searches == {}
+
+
+def test_directed_probes_are_queued_as_they_are_due():
+    wsd = FakeDiscovery()
+    wsd.sendUnicastMessage = lambda env, host, port, initialDelay=0: wsd.sent.append(host)
+
+    searches = {}
+    sweep = wsd._startTargetSearches("10.0.0.0/16", None, None, 3702, 1000, searches)
+    wait = next(sweep)
+    assert 0 < wait <= 0.1
+    assert 90 <= len(wsd.sent) <= 110  # the probes due within TARGET_PROBE_QUEUE_AHEAD
+    sweep.close()
+    wsd._endSearches(searches)
+
+    with pytest.raises(ValueError):
+        wsd.probeTargets("10.0.0.0/8")
+    assert wsd._searches == {}
+
+
+def test_resolves_are_coalesced_and_cached():
+    wsd = FakeDiscovery()
+    nameless = Service([], [], [], "urn:uuid:2", 0)
+    addr = ("10.0.0.2", 3702)
+
+    def find(search):
+        wsd.envReceived(constructProbeMatch([nameless], search.messageId), addr)
+
+    first = wsd._startSearch(None, None, None, None)
+    second = wsd._startSearch(None, None, None, None)
+    find(first)
+    find(second)
+    resolves = [env for env in wsd.sent if env.getAction() == NS_ACTION_RESOLVE]
+    assert len(resolves) == 1
+    assert not second.isResolved()
+
+    resolved = Service([], [], ["http://10.0.0.2/"], "urn:uuid:2", 0)
+    wsd.envReceived(constructResolveMatch(resolved, resolves[0].getMessageId()), addr)
+    assert first.isResolved() and second.isResolved()
+
+    third = wsd._startSearch(None, None, None, None)
+    find(third)
+    assert [s.getXAddrs() for s in third.getServices()] == [["http://10.0.0.2/"]]
+
+    wsd.envReceived(constructBye(resolved), addr)
+    fourth = wsd._startSearch(None, None, None, None)
+    find(fourth)
+    assert len([env for env in wsd.sent if env.getAction() == NS_ACTION_RESOLVE]) == 2
+
+
+def test_silent_services_are_reported_disappeared():
+    wsd = FakeDiscovery(remoteServiceTTL=60)
+    disappeared = []
+    wsd.setRemoveServiceDisappearedCallback(disappeared.append)
+    hellos = []
+    wsd.setRemoteServiceHelloCallback(hellos.append)
+    now = [1000.0]
+    wsd._remoteServices._timer = lambda: now[0]
+
+    device = Service([], [], ["http://10.0.0.1/"], "urn:uuid:1", 0)
+    wsd.envReceived(constructHello(device), ("10.0.0.1", 3702))
+    known = wsd._remoteServices.get("urn:uuid:1")
+    now[0] += 50
+    wsd.envReceived(constructHello(device), ("10.0.0.1", 3702))
+    assert wsd._remoteServices.get("urn:uuid:1") is known  # unchanged metadata version
+    assert hellos == [known, known]  # not rebuilt either
+
+    now[0] += 50
+    wsd._expireRemoteServices()
+    assert disappeared == []
+    now[0] += 20
+    wsd._expireRemoteServices()
+    assert disappeared == ["urn:uuid:1"]
+    assert "urn:uuid:1" not in wsd._remoteServices
+
+
+def _announceProxy(wsd, epr, host):
+    env = constructHello(Service([], [], ["soap.udp://%s:3702" % host], epr, 0))
+    env.setRelationshipType(QName(NS_DISCOVERY, "Suppression"))
+    wsd.envReceived(env, (host, 3702))
+
+
+def test_probes_go_to_proxies_with_failover_and_cached_answers():
+    wsd = FakeDiscovery()
+    wsd.sendMulticastMessage = lambda env, initialDelay=0: wsd.sent.append(None)
+    wsd.sendUnicastMessage = lambda env, host, port, initialDelay=0: wsd.sent.append(host)
+    _announceProxy(wsd, "urn:uuid:proxy1", "10.0.0.8")
+    _announceProxy(wsd, "urn:uuid:proxy2", "10.0.0.9")
+
+    first = wsd._startSearch(None, None, None, None)
+    assert wsd.sent == ["10.0.0.8"]
+    device = Service([], [], ["http://10.0.0.1/"], "urn:uuid:1", 0)
+    wsd.envReceived(constructProbeMatch([device], first.messageId), ("10.0.0.8", 3702))
+    wsd._endSearch(first)
+    assert wsd.getProxies()[-1].latency is not None
+    # a search cut short does not leave a cached answer
+    assert wsd._proxies.getAnswer(None, None) is None
+    first.complete = True
+    wsd._endSearch(first)
+
+    # the proxy that has not answered yet is tried first, then the one that has, then multicast
+    second = wsd._startSearch([QName("http://example.com", "Printer")], None, None, None)
+    wsd._failOver(second)
+    # a late answer of the proxy failed over from is not credited to the next one
+    latency = wsd.getProxies()[-1].latency
+    wsd.envReceived(constructProbeMatch([], second.messageId), ("10.0.0.9", 3702))
+    assert [proxy.latency for proxy in wsd.getProxies()] == [None, latency]
+    wsd._failOver(second)
+    assert wsd.sent == ["10.0.0.8", "10.0.0.9", "10.0.0.8", None]
+    assert second.proxy is None
+
+    cached = wsd._startSearch(None, None, None, None)
+    assert cached.cached and [s.getEPR() for s in cached.getServices()] == ["urn:uuid:1"]
+    assert len(wsd.sent) == 4
+
+    # a proxy leaving clears the cached answers
+    wsd.envReceived(constructBye(Service([], [], [], "urn:uuid:proxy1", 0)), ("10.0.0.8", 3702))
+    assert [proxy.epr for proxy in wsd.getProxies()] == ["urn:uuid:proxy2"]
+    assert not wsd._startSearch(None, None, None, None).cached
+    assert wsd.sent[-1] == "10.0.0.9"
+
+    wsd.clearRemoteServices()
+    assert [proxy.epr for proxy in wsd.getProxies()] == ["urn:uuid:proxy2"]
+    wsd.clearProxies()
+    assert wsd.getProxies() == []
+
+
+def test_daemon_without_discovery_multicasts_probes():
+    daemon = FakeDaemon()
+    daemon._sendProbe()
+    daemon._sendResolve("urn:uuid:1")
+    assert [env.getAction() for env in daemon.sent] == [NS_ACTION_PROBE, NS_ACTION_RESOLVE]
@@ -0,0 +1,29 @@
+import wsdiscovery.service
+from wsdiscovery.service import Service
+
+
+def test_ip_pattern_is_expanded_once(monkeypatch):
+    calls = []
+
+    def getNetworkAddrs():
+        calls.append(1)
+        return ["10.0.0.1", "127.0.0.1"]
+
+    monkeypatch.setattr(wsdiscovery.service, "_getNetworkAddrs", getNetworkAddrs)
+    service = Service([], [], ["http://{ip}:80/x", "http://example.com/"], "urn:uuid:1", 0)
+
+    assert service.getXAddrs() == ["http://10.0.0.1:80/x", "http://example.com/"]
+    assert service.getXAddrs() == ["http://10.0.0.1:80/x", "http://example.com/"]
+    assert len(calls) == 1
+
+    service.setNetworkAddrs(["10.0.0.2", "10.0.0.3"])
+    assert service.getXAddrs() == ["http://10.0.0.2:80/x", "http://10.0.0.3:80/x",
+                                   "http://example.com/"]
+    assert len(calls) == 1
+
+
+def test_ip_pattern_is_expanded_with_ipv6_addresses():
+    service = Service([], [], ["http://{ip}:80/x"], "urn:uuid:1", 0)
+    service.setNetworkAddrs(["10.0.0.1", "fd00::2", "fe80::1%eth0"])
+
+    assert service.getXAddrs() == ["http://10.0.0.1:80/x", "http://[fd00::2]:80/x"]
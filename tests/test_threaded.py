@@ -0,0 +1,135 @@
+import queue
+import socket
+import threading
+
+import pytest
+
+import wsdiscovery.threaded
+from wsdiscovery.threaded import AddressMonitorThread, DatagramWorkerPool, NetworkingThread
+from wsdiscovery.transport import supportsPktinfo, makePktinfo, parsePktinfo, getReplyHost
+from wsdiscovery.udp import UDPMessage
+
+
+class Handler:
+    def __init__(self):
+        self._observer = self
+        self.received = []
+        self.release = threading.Event()
+
+    def _parseDatagram(self, data, addr):
+        self.release.wait()
+        return data
+
+    def envReceived(self, env, addr):
+        self.received.append(env)
+
+
+def test_worker_pool_drops_datagrams_when_full():
+    handler = Handler()
+    pool = DatagramWorkerPool(handler, workers=2, queueSize=4)
+    pool.start()
+
+    for i in range(10):
+        pool.submit(i, ("10.0.0.1", 3702))
+    handler.release.set()
+    pool.stop()
+
+    stats = pool.getStats()
+    assert stats["submitted"] + stats["dropped"] == 10
+    assert 4 <= stats["submitted"] <= 6
+    assert len(handler.received) == stats["submitted"]
+
+
+class FakeWatcher:
+    "address watcher notified through a socket pair"
+
+    def __init__(self):
+        self._recv, self._send = socket.socketpair()
+
+    def notify(self):
+        self._send.send(b"\0")
+
+    def fileno(self):
+        return self._recv.fileno()
+
+    def read(self):
+        self._recv.recv(16)
+        return True
+
+    def close(self):
+        self._recv.close()
+        self._send.close()
+
+
+def test_address_monitor_updates_on_notification(monkeypatch):
+    addrs = ["10.0.0.1"]
+    monkeypatch.setattr(wsdiscovery.threaded, "_getNetworkAddrs", lambda: list(addrs))
+    added = queue.Queue()
+
+    class Daemon:
+        _networkAddressAdded = added.put
+        _networkAddressRemoved = lambda self, addr: None
+
+    watcher = FakeWatcher()
+    monitor = AddressMonitorThread(Daemon(), watcher)
+    monitor.start()
+    addrs.append("10.0.0.2")
+    watcher.notify()
+
+    assert added.get(timeout=5) == "10.0.0.1"
+    assert added.get(timeout=5) == "10.0.0.2"
+    monitor.schedule_stop()
+    monitor.join()
+
+
+class RecordingSocket:
+    def __init__(self):
+        self.sent = []
+
+    def sendmsg(self, buffers, ancdata, flags, address):
+        self.sent.append((parsePktinfo(ancdata), address))
+
+
+@pytest.mark.skipif(not supportsPktinfo(), reason="IP_PKTINFO is not supported")
+def test_shared_socket_sends_from_every_address():
+    class Observer:
+        _capture = None
+
+    thread = NetworkingThread(Observer(), sharedSocket=True)
+    thread._multiOutSocket = RecordingSocket()
+    thread._sourcePktinfos = {addr: makePktinfo(addr) for addr in ("10.0.0.1", "10.0.1.1")}
+
+    msg = UDPMessage(None, "239.255.255.250", 3702, UDPMessage.MULTICAST)
+    msg._data = b"<x/>"
+    thread._sendMsg(msg)
+
+    assert thread._multiOutSocket.sent == [("10.0.0.1", ("239.255.255.250", 3702)),
+                                           ("10.0.1.1", ("239.255.255.250", 3702))]
+
+
+def test_multicast_goes_to_both_families():
+    class Observer:
+        _capture = None
+
+    thread = NetworkingThread(Observer(), ipv6=True)
+    thread._multiOutUniInSockets = {"10.0.0.1": "socket4"}
+    thread._multiOutSocket6 = "socket6"
+    thread._interfaces6 = {2: 1, 3: 2}
+
+    msg = UDPMessage(None, "239.255.255.250", 3702, UDPMessage.MULTICAST)
+    assert thread._getOutSockets(msg) == [("socket4", ("239.255.255.250", 3702), None),
+                                          ("socket6", ("FF02::C", 3702, 0, 2), None),
+                                          ("socket6", ("FF02::C", 3702, 0, 3), None)]
+
+
+def test_unicast_replies_keep_the_ipv6_zone():
+    class Observer:
+        _capture = None
+
+    thread = NetworkingThread(Observer(), ipv6=True)
+    thread._uniOutSocket6 = "socket6"
+
+    host = getReplyHost(("fe80::1", 3702, 0, 2))
+    msg = UDPMessage(None, host, 3702, UDPMessage.UNICAST)
+    assert host == "fe80::1%2"
+    assert thread._getOutSockets(msg) == [("socket6", ("fe80::1", 3702, 0, 2), None)]
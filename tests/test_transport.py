@@ -0,0 +1,98 @@
+import io
+from wsdiscovery.actions import constructHello, constructBye, constructProbeMatch
+from wsdiscovery.message import createSOAPMessage
+from wsdiscovery.service import Service
+from wsdiscovery.transport import DatagramHandler, MESSAGE_ID_CACHE_SIZE
+
+
+class Observer:
+    _capture = None
+
+    def __init__(self):
+        self.received = []
+
+    def envReceived(self, env, addr):
+        self.received.append(env.getAction())
+
+
+def _serialize(env):
+    return createSOAPMessage(env).encode("UTF-8")
+
+
+def test_stale_announcements_are_dropped():
+    observer = Observer()
+    handler = DatagramHandler(observer)
+    service = Service([], [], [], "urn:uuid:1234", 42)
+    addr = ("10.0.0.1", 3702)
+
+    first = _serialize(constructHello(service))
+    second = _serialize(constructHello(service))
+    service.incrementMessageNumber()
+    bye = _serialize(constructBye(service))
+
+    handler._handleDatagram(second, addr)
+    handler._handleDatagram(first, addr)  # reordered
+    handler._handleDatagram(bye, addr)
+    handler._handleDatagram(bye, addr)    # repeated
+
+    assert len(observer.received) == 2
+    stats = handler.getStats()
+    assert stats["appSequences"]["stale"] == 1
+    assert stats["knownMessageIds"]["hits"] == 1
+
+
+def test_sequences_are_tracked_per_sender():
+    observer = Observer()
+    handler = DatagramHandler(observer)
+    first = Service([], [], [], "urn:uuid:1234", 1)
+    second = Service([], [], [], "urn:uuid:5678", 1)
+
+    handler._handleDatagram(_serialize(constructHello(first)), ("10.0.0.1", 3702))
+    handler._handleDatagram(_serialize(constructHello(second)), ("10.0.0.2", 3702))
+
+    assert len(observer.received) == 2
+    assert handler.getStats()["appSequences"]["stale"] == 0
+
+
+def test_echoes_of_sent_messages_are_dropped():
+    observer = Observer()
+    handler = DatagramHandler(observer)
+    env = constructHello(Service([], [], [], "urn:uuid:1234", 42))
+
+    handler._registerMessage(env)
+    handler._handleDatagram(_serialize(env), ("10.0.0.1", 3702))
+
+    assert observer.received == []
+
+
+def test_sent_messages_do_not_evict_received_ones():
+    observer = Observer()
+    handler = DatagramHandler(observer)
+    service = Service([], [], [], "urn:uuid:1234", 42)
+    received = _serialize(constructProbeMatch([service], "urn:uuid:probe"))
+    handler._handleDatagram(received, ("10.0.0.1", 3702))
+
+    for i in range(MESSAGE_ID_CACHE_SIZE):
+        handler._registerMessage(constructHello(service))
+    handler._handleDatagram(received, ("10.0.0.1", 3702))  # repeated
+
+    assert len(observer.received) == 1
+
+
+def test_malformed_datagrams_are_dropped():
+    observer = Observer()
+    handler = DatagramHandler(observer)
+    for data in (b"not xml", b"\xff\xfe garbage",
+                 b'<?xml version="1.0" encoding="x-bogus"?><a/>'):
+        handler._handleDatagram(data, ("10.0.0.1", 3702))
+
+    assert observer.received == []
+
+
+def test_undecodable_datagrams_are_captured():
+    observer = Observer()
+    observer._capture = io.StringIO()
+    handler = DatagramHandler(observer)
+    handler._handleDatagram(b"\xff\xfe garbage", ("10.0.0.1", 3702))
+
+    assert observer._capture.getvalue() == "1 RECV 10.0.0.1:3702\n\ufffd\ufffd garbage\n"
@@ -0,0 +1,28 @@
+from wsdiscovery.actions import constructProbe
+from wsdiscovery.udp import UDPMessage, UDPMessageScheduler
+
+
+def test_scheduler_pops_all_due_messages_in_deadline_order():
+    scheduler = UDPMessageScheduler()
+    late = UDPMessage(None, "127.0.0.1", 3702, UDPMessage.UNICAST, initialDelay=60000)
+    second = UDPMessage(None, "127.0.0.1", 3702, UDPMessage.UNICAST, initialDelay=-10)
+    first = UDPMessage(None, "127.0.0.1", 3702, UDPMessage.UNICAST, initialDelay=-20)
+    for msg in (late, second, first):
+        scheduler.add(msg)
+
+    assert scheduler.popDue() == [first, second]
+    assert len(scheduler) == 1
+    assert scheduler.getDelay() > 59000
+
+
+def test_message_is_serialized_once_until_invalidated():
+    env = constructProbe(None, None)
+    msg = UDPMessage(env, "239.255.255.250", 3702, UDPMessage.MULTICAST)
+
+    data = msg.getData()
+    assert msg.getData() is data
+    assert env.getMessageId().encode("UTF-8") in data
+
+    env.setMessageId("urn:uuid:changed")
+    msg.invalidate()
+    assert b"urn:uuid:changed" in msg.getData()
@@ -0,0 +1,13 @@
+from wsdiscovery.util import matchScope, MATCH_BY_URI, MATCH_BY_STRCMP
+
+
+def test_match_scope_rules():
+    assert matchScope("onvif://www.onvif.org/Profile", "onvif://www.onvif.org/Profile/Streaming", None)
+    assert matchScope("onvif://www.onvif.org/Profile/", "onvif://www.onvif.org/Profile/Streaming", "")
+    assert not matchScope("onvif://www.onvif.org/Prof", "onvif://www.onvif.org/Profile", None)
+    assert not matchScope("onvif://www.onvif.org/Profile/", "onvif://www.onvif.org/Profile", None)
+    assert matchScope("HTTP://User@example.com/a", "http://user@example.com/a/b", MATCH_BY_URI)
+    assert not matchScope("http://user@example.com/A", "http://user@example.com/a", MATCH_BY_URI)
+    assert matchScope("Some Scope", "Some Scope", MATCH_BY_STRCMP)
+    assert not matchScope("Some Scope", "some scope", MATCH_BY_STRCMP)
+    assert not matchScope("a:b", "a:b", "http://example.com/unknown-rule")
@@ -1,12 +1,12 @@
 """
-The actions subpackage provides WS-Discovery action message construction and parsing.
+The actions subpackage provides WS-Discovery action message construction and serialization.
 """
 
-from .bye import NS_ACTION_BYE, constructBye, createByeMessage, parseByeMessage
-from .hello import NS_ACTION_HELLO, constructHello, createHelloMessage, parseHelloMessage
-from .probe import NS_ACTION_PROBE, constructProbe, createProbeMessage, parseProbeMessage
-from .probematch import NS_ACTION_PROBE_MATCH, constructProbeMatch, createProbeMatchMessage, parseProbeMatchMessage
+from .bye import NS_ACTION_BYE, constructBye, createByeMessage
+from .hello import NS_ACTION_HELLO, constructHello, createHelloMessage
+from .probe import NS_ACTION_PROBE, constructProbe, createProbeMessage
+from .probematch import NS_ACTION_PROBE_MATCH, constructProbeMatch, createProbeMatchMessage
 from .probematch import ProbeResolveMatch
-from .resolve import NS_ACTION_RESOLVE, constructResolve, createResolveMessage, parseResolveMessage
-from .resolvematch import NS_ACTION_RESOLVE_MATCH, constructResolveMatch, createResolveMatchMessage, parseResolveMatchMessage
+from .resolve import NS_ACTION_RESOLVE, constructResolve, createResolveMessage
+from .resolvematch import NS_ACTION_RESOLVE_MATCH, constructResolveMatch, createResolveMatchMessage
 
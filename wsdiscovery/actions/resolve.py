@@ -1,11 +1,10 @@
-"Serialize & parse WS-Discovery Resolve SOAP messages"
+"Construct & serialize WS-Discovery Resolve SOAP messages"
 
 import uuid
 
-from ..namespaces import NS_ADDRESSING, NS_DISCOVERY, NS_ACTION_RESOLVE, NS_ADDRESS_ALL
+from ..namespaces import NS_ACTION_RESOLVE, NS_ADDRESS_ALL
 from ..envelope import SoapEnvelope
-from ..util import createSkelSoapMessage, getBodyEl, getHeaderEl, addElementWithText, \
-                   addEPR, addTypes, addScopes, getDocAsString, getScopes
+from ..util import SoapMessageWriter
 
 
 def constructResolve(epr):
@@ -22,39 +21,16 @@ def constructResolve(epr):
 def createResolveMessage(env):
     "serialize a SOAP envelope object into a string"
 
-    doc = createSkelSoapMessage(NS_ACTION_RESOLVE)
+    msg = SoapMessageWriter(NS_ACTION_RESOLVE)
 
-    bodyEl = getBodyEl(doc)
-    headerEl = getHeaderEl(doc)
-
-    addElementWithText(doc, headerEl, "a:MessageID", NS_ADDRESSING, env.getMessageId())
-    addElementWithText(doc, headerEl, "a:To", NS_ADDRESSING, env.getTo())
+    msg.addHeaderText("a:MessageID", env.getMessageId())
+    msg.addHeaderText("a:To", env.getTo())
 
     if len(env.getReplyTo()) > 0:
-        addElementWithText(doc, headerEl, "a:ReplyTo", NS_ADDRESSING, env.getReplyTo())
-
-    resolveEl = doc.createElementNS(NS_DISCOVERY, "d:Resolve")
-    addEPR(doc, resolveEl, env.getEPR())
-    bodyEl.appendChild(resolveEl)
-
-    return getDocAsString(doc)
-
-
-def parseResolveMessage(dom):
-    "parse a XML message into a SOAP envelope object"
-
-    env = SoapEnvelope()
-    env.setAction(NS_ACTION_RESOLVE)
-
-    env.setMessageId(dom.getElementsByTagNameNS(NS_ADDRESSING, "MessageID")[0].firstChild.data.strip())
-
-    replyToNodes = dom.getElementsByTagNameNS(NS_ADDRESSING, "ReplyTo")
-    if len(replyToNodes) > 0:
-        env.setReplyTo(replyToNodes[0].firstChild.data.strip())
-
-    env.setTo(dom.getElementsByTagNameNS(NS_ADDRESSING, "To")[0].firstChild.data.strip())
-    env.setEPR(dom.getElementsByTagNameNS(NS_ADDRESSING, "Address")[0].firstChild.data.strip())
-
-    return env
+        msg.addHeaderText("a:ReplyTo", env.getReplyTo())
 
+    msg.startElement("d:Resolve")
+    msg.addEPR(env.getEPR())
+    msg.endElement("d:Resolve")
 
+    return msg.getMessage()
@@ -1,13 +1,11 @@
-"Serialize & parse WS-Discovery Resolve Match SOAP messages"
+"Construct & serialize WS-Discovery Resolve Match SOAP messages"
 
 import uuid
 
-from ..namespaces import NS_ADDRESSING, NS_DISCOVERY, NS_ACTION_RESOLVE_MATCH, NS_ADDRESS_UNKNOWN
+from ..namespaces import NS_ACTION_RESOLVE_MATCH, NS_ADDRESS_UNKNOWN
 from ..envelope import SoapEnvelope
-from ..util import createSkelSoapMessage, getBodyEl, getHeaderEl, addElementWithText, \
-                   addTypes, getTypes, addScopes, getDocAsString, getScopes, addEPR, \
-                   addXAddrs, getXAddrs, _parseAppSequence
-                   
+from ..util import SoapMessageWriter
+
 from .probematch import ProbeResolveMatch
 
 
@@ -33,71 +31,23 @@ def constructResolveMatch(service, relatesTo):
 def createResolveMatchMessage(env):
     "serialize a SOAP envelope object into a string"
 
-    doc = createSkelSoapMessage(NS_ACTION_RESOLVE_MATCH)
-
-    bodyEl = getBodyEl(doc)
-    headerEl = getHeaderEl(doc)
-
-    addElementWithText(doc, headerEl, "a:MessageID", NS_ADDRESSING, env.getMessageId())
-    addElementWithText(doc, headerEl, "a:RelatesTo", NS_ADDRESSING, env.getRelatesTo())
-    addElementWithText(doc, headerEl, "a:To", NS_ADDRESSING, env.getTo())
+    msg = SoapMessageWriter(NS_ACTION_RESOLVE_MATCH)
 
-    appSeqEl = doc.createElementNS(NS_DISCOVERY, "d:AppSequence")
-    appSeqEl.setAttribute("InstanceId", env.getInstanceId())
-    appSeqEl.setAttribute("MessageNumber", env.getMessageNumber())
-    headerEl.appendChild(appSeqEl)
+    msg.addHeaderText("a:MessageID", env.getMessageId())
+    msg.addHeaderText("a:RelatesTo", env.getRelatesTo())
+    msg.addHeaderText("a:To", env.getTo())
+    msg.addAppSequence(env)
 
-    resolveMatchesEl = doc.createElementNS(NS_DISCOVERY, "d:ResolveMatches")
+    msg.startElement("d:ResolveMatches")
     if len(env.getProbeResolveMatches()) > 0:
         resolveMatch = env.getProbeResolveMatches()[0]
-        resolveMatchEl = doc.createElementNS(NS_DISCOVERY, "d:ResolveMatch")
-        addEPR(doc, resolveMatchEl, resolveMatch.getEPR())
-        addTypes(doc, resolveMatchEl, resolveMatch.getTypes())
-        addScopes(doc, resolveMatchEl, resolveMatch.getScopes())
-        addXAddrs(doc, resolveMatchEl, resolveMatch.getXAddrs())
-        addElementWithText(doc, resolveMatchEl, "d:MetadataVersion", NS_DISCOVERY, resolveMatch.getMetadataVersion())
-
-        resolveMatchesEl.appendChild(resolveMatchEl)
-
-    bodyEl.appendChild(resolveMatchesEl)
-
-    return getDocAsString(doc)
-
-
-def parseResolveMatchMessage(dom):
-    "parse a XML message into a SOAP envelope object"
-
-    env = SoapEnvelope()
-    env.setAction(NS_ACTION_RESOLVE_MATCH)
-
-    env.setMessageId(dom.getElementsByTagNameNS(NS_ADDRESSING, "MessageID")[0].firstChild.data.strip())
-    env.setRelatesTo(dom.getElementsByTagNameNS(NS_ADDRESSING, "RelatesTo")[0].firstChild.data.strip())
-    env.setTo(dom.getElementsByTagNameNS(NS_ADDRESSING, "To")[0].firstChild.data.strip())
-
-    _parseAppSequence(dom, env)
-
-    nodes = dom.getElementsByTagNameNS(NS_DISCOVERY, "ResolveMatch")
-    if len(nodes) > 0:
-        node = nodes[0]
-        epr = node.getElementsByTagNameNS(NS_ADDRESSING, "Address")[0].firstChild.data.strip()
-
-        typeNodes = node.getElementsByTagNameNS(NS_DISCOVERY, "Types")
-        types = []
-        if len(typeNodes) > 0:
-            types = getTypes(typeNodes[0])
-
-        scopeNodes = node.getElementsByTagNameNS(NS_DISCOVERY, "Scopes")
-        scopes = []
-        if len(scopeNodes) > 0:
-            scopes = getScopes(scopeNodes[0])
-
-        xAddrs = getXAddrs(node.getElementsByTagNameNS(NS_DISCOVERY, "XAddrs")[0])
-        mdv = node.getElementsByTagNameNS(NS_DISCOVERY, "MetadataVersion")[0].firstChild.data.strip()
-        env.getProbeResolveMatches().append(ProbeResolveMatch(epr, types, scopes, xAddrs, mdv))
-
-    return env
-
-
-
-
-
+        msg.startElement("d:ResolveMatch")
+        msg.addEPR(resolveMatch.getEPR())
+        msg.addTypes(resolveMatch.getTypes())
+        msg.addScopes(resolveMatch.getScopes())
+        msg.addXAddrs(resolveMatch.getXAddrs())
+        msg.addText("d:MetadataVersion", resolveMatch.getMetadataVersion())
+        msg.endElement("d:ResolveMatch")
+    msg.endElement("d:ResolveMatches")
+
+    return msg.getMessage()
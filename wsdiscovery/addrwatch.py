@@ -0,0 +1,91 @@
+"""Watching local network addresses for changes.
+
+An address watcher tells the address monitor when the local network
+addresses may have changed, so that the monitor only enumerates the
+addresses when needed. On Linux, the kernel reports address changes
+through an rtnetlink socket; elsewhere, the addresses are polled.
+"""
+
+import errno
+import logging
+import socket
+import struct
+
+
+logger = logging.getLogger("addrwatch")
+
+
+# rtnetlink message types & multicast groups for address changes, see rtnetlink(7)
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV6_IFADDR = 0x100
+
+_NLMSGHDR = struct.Struct("=LHHLL")  # length, type, flags, sequence number, port id
+
+
+class PollingAddressWatcher:
+    "address watcher for platforms without change notifications; the addresses are polled"
+
+    def fileno(self):
+        "get the file descriptor to wait on for changes; None means polling"
+        return None
+
+    def read(self):
+        "read pending notifications; returns True if the addresses may have changed"
+        return True
+
+    def close(self):
+        pass
+
+
+class NetlinkAddressWatcher:
+    "address watcher that receives address change notifications from the Linux kernel"
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, socket.NETLINK_ROUTE)
+        try:
+            self._sock.bind((0, RTMGRP_IPV4_IFADDR | RTMGRP_IPV6_IFADDR))
+            self._sock.setblocking(0)
+        except OSError:
+            self._sock.close()
+            raise
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def read(self):
+        changed = False
+        while True:
+            try:
+                data = self._sock.recv(0xffff)
+            except BlockingIOError:
+                return changed
+            except OSError as ex:
+                if ex.errno != errno.ENOBUFS:
+                    raise
+                # notifications were lost, so anything may have changed
+                changed = True
+                continue
+
+            offset = 0
+            while offset + _NLMSGHDR.size <= len(data):
+                length, msgType = _NLMSGHDR.unpack_from(data, offset)[:2]
+                if msgType in (RTM_NEWADDR, RTM_DELADDR):
+                    changed = True
+                if length < _NLMSGHDR.size:
+                    break
+                offset += (length + 3) & ~3  # messages are 4-byte aligned
+
+    def close(self):
+        self._sock.close()
+
+
+def createAddressWatcher():
+    "create the most efficient address watcher available on this platform"
+    if hasattr(socket, "AF_NETLINK"):
+        try:
+            return NetlinkAddressWatcher()
+        except OSError as ex:
+            logger.debug("cannot watch addresses with rtnetlink, polling: %s", ex)
+    return PollingAddressWatcher()
@@ -0,0 +1,476 @@
+"""Asyncio networking facilities for implementing WS-Discovery daemons that
+run in an asyncio event loop, without any extra threads.
+
+The module is not named ``async``, since that is a reserved word.
+"""
+
+import asyncio
+import collections
+import logging
+import socket
+import time
+
+from .udp import UDPMessage, UDPMessageScheduler
+from .transport import DatagramHandler, MULTICAST_PORT, MULTICAST_IPV4_ADDRESS, \
+                       makeMreq, createMulticastOutSocket, createMulticastInSocket
+from .threaded import AddressMonitor, NETWORK_ADDRESSES_CHECK_TIMEOUT
+from .daemon import Daemon
+from .discovery import Discovery, RESOLVE_TIMEOUT
+from .proxy import PROXY_TIMEOUT
+from .publishing import Publishing
+from .search import SearchContext
+
+
+logger = logging.getLogger("asyncio")
+
+
+class _DatagramProtocol(asyncio.DatagramProtocol):
+    "pass datagrams received on a socket on to the networking engine"
+
+    def __init__(self, engine):
+        self._engine = engine
+
+    def datagram_received(self, data, addr):
+        self._engine._handleDatagram(data, addr)
+
+    def error_received(self, exc):
+        logger.debug("socket error: %s", exc)
+
+
+class AsyncAddressMonitor(AddressMonitor):
+    """watch local service addresses for changes in the event loop; when the
+    watcher cannot be waited on, the addresses are polled with a timer"""
+
+    def __init__(self, wsd, loop, watcher=None):
+        super().__init__(wsd, watcher)
+        self._loop = loop
+        self._handle = None
+
+    def _poll(self):
+        self._updateAddrs()
+        self._handle = self._loop.call_later(NETWORK_ADDRESSES_CHECK_TIMEOUT, self._poll)
+
+    def _read(self):
+        if self._watcher.read():
+            self._updateAddrs()
+
+    def start(self):
+        if self._watcher.fileno() is None:
+            self._poll()
+        else:
+            self._loop.add_reader(self._watcher.fileno(), self._read)
+            self._updateAddrs()
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if self._watcher.fileno() is not None:
+            self._loop.remove_reader(self._watcher.fileno())
+        self._watcher.close()
+
+
+class AsyncNetworkingEngine(DatagramHandler):
+    """Send & receive messages using asyncio datagram transports.
+
+    A single event loop timer is kept armed for the earliest due message,
+    so the engine only wakes up when a socket is readable or a message is
+    to be sent. All methods must be called from the event loop thread.
+    """
+
+    def __init__(self, observer, loop):
+        super().__init__(observer)
+        self._loop = loop
+        self._queue = UDPMessageScheduler()
+        self._timer = None
+        self._timerDeadline = None
+        self._idle = None
+        self._attaching = set()
+        self._uniOutTransport = None
+        self._multiInTransport = None
+        self._multiOutUniInTransports = {}
+
+    def _getOwnAddrs(self):
+        monitor = self._observer._addrsMonitor
+        return monitor._addrs if monitor is not None else set()
+
+    async def _createEndpoint(self, sock):
+        transport, _ = await self._loop.create_datagram_endpoint(lambda: _DatagramProtocol(self), sock=sock)
+        return transport
+
+    async def _attachSourceAddr(self, addr, sock):
+        transport = await self._createEndpoint(sock)
+        if addr in self._multiOutUniInTransports:
+            self._multiOutUniInTransports[addr] = transport
+        else:  # removed while the transport was being set up
+            transport.close()
+
+    async def start(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+        self._uniOutTransport = await self._createEndpoint(sock)
+        self._multiInTransport = await self._createEndpoint(createMulticastInSocket())
+
+    async def settle(self):
+        "wait until the sockets of all added source addresses are ready"
+        while self._attaching:
+            await asyncio.wait(list(self._attaching))
+
+    def addSourceAddr(self, addr):
+        """None means 'system default'"""
+        sock = self._multiInTransport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, makeMreq(addr))
+        except socket.error:  # if 1 interface has more than 1 address, exception is raised for the second
+            pass
+
+        self._multiOutUniInTransports[addr] = None
+        task = self._loop.create_task(self._attachSourceAddr(addr, createMulticastOutSocket(addr, self._observer.ttl)))
+        self._attaching.add(task)
+        task.add_done_callback(self._attaching.discard)
+
+    def removeSourceAddr(self, addr):
+        sock = self._multiInTransport.get_extra_info("socket")
+        try:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, makeMreq(addr))
+        except socket.error:  # see comments for setsockopt(.., socket.IP_ADD_MEMBERSHIP..
+            pass
+
+        transport = self._multiOutUniInTransports.pop(addr, None)
+        if transport is not None:
+            transport.close()
+
+    def addUnicastMessage(self, env, addr, port, initialDelay=0):
+        msg = UDPMessage(env, addr, port, UDPMessage.UNICAST, initialDelay)
+
+        self._schedule(msg)
+        self._registerMessage(env)
+
+    def addMulticastMessage(self, env, addr, port, initialDelay=0):
+        msg = UDPMessage(env, addr, port, UDPMessage.MULTICAST, initialDelay)
+
+        self._schedule(msg)
+        self._registerMessage(env)
+
+    def _schedule(self, msg):
+        self._queue.add(msg)
+        self._armTimer()
+
+    def _armTimer(self):
+        "make sure the timer fires when the earliest queued message is due"
+        delay = self._queue.getDelay()
+        if delay is None:
+            return
+        deadline = self._loop.time() + delay / 1000
+        if self._timer is not None:
+            if self._timerDeadline <= deadline:
+                return
+            self._timer.cancel()
+        self._timer = self._loop.call_at(deadline, self._sendPendingMessages)
+        self._timerDeadline = deadline
+
+    def _sendPendingMessages(self):
+        self._timer = None
+        for msg in self._queue.popDue():
+            self._sendMsg(msg)
+            msg.refresh()
+            if not msg.isFinished():
+                self._queue.add(msg)
+
+        if self._queue:
+            self._armTimer()
+        elif self._idle is not None and not self._idle.done():
+            self._idle.set_result(None)
+
+    def _sendMsg(self, msg):
+        data = msg.getData()
+
+        if msg.msgType() == UDPMessage.UNICAST:
+            self._uniOutTransport.sendto(data, (msg.getAddr(), msg.getPort()))
+            self._captureMessage("SEND", msg.getAddr(), msg.getPort(), data)
+        else:
+            for transport in list(self._multiOutUniInTransports.values()):
+                if transport is None:
+                    continue
+                transport.sendto(data, (msg.getAddr(), msg.getPort()))
+                self._captureMessage("SEND", msg.getAddr(), msg.getPort(), data)
+
+    async def stop(self):
+        "wait for pending messages to be sent, then close all sockets"
+        if self._queue:
+            self._idle = self._loop.create_future()
+            await self._idle
+
+        for task in list(self._attaching):
+            task.cancel()
+
+        for transport in list(self._multiOutUniInTransports.values()):
+            if transport is not None:
+                transport.close()
+        self._multiOutUniInTransports.clear()
+
+        self._uniOutTransport.close()
+        self._multiInTransport.close()
+
+
+class AsyncNetworking:
+    "handle asyncio networking start & stop, address add/remove & message sending"
+
+    def __init__(self, **kwargs):
+        self._networkingEngine = None
+        self._addrsMonitor = None
+        self._serverStarted = False
+        super().__init__(**kwargs)
+
+    async def start(self):
+        "start networking - should be awaited before using other methods"
+        if self._networkingEngine is not None:
+            return
+
+        loop = asyncio.get_event_loop()
+        self._networkingEngine = AsyncNetworkingEngine(self, loop)
+        await self._networkingEngine.start()
+        logger.debug("networking engine started")
+        self._addrsMonitor = AsyncAddressMonitor(self, loop)
+        self._addrsMonitor.start()
+        logger.debug("address monitoring started")
+        await self._networkingEngine.settle()
+        self._serverStarted = True
+
+    async def stop(self):
+        "cleans up and stops networking"
+        if self._networkingEngine is None:
+            return
+
+        self._addrsMonitor.stop()
+        await self._networkingEngine.stop()
+
+        self._networkingEngine = None
+        self._serverStarted = False
+
+    def addSourceAddr(self, addr):
+        self._networkingEngine.addSourceAddr(addr)
+
+    def removeSourceAddr(self, addr):
+        self._networkingEngine.removeSourceAddr(addr)
+
+    def sendUnicastMessage(self, env, host, port, initialDelay=0):
+        "handle unicast message sending"
+        self._networkingEngine.addUnicastMessage(env, host, port, initialDelay)
+
+    def sendMulticastMessage(self, env, initialDelay=0):
+        "handle multicast message sending"
+        self._networkingEngine.addMulticastMessage(env, MULTICAST_IPV4_ADDRESS, MULTICAST_PORT, initialDelay)
+
+
+class AsyncSearchContext(SearchContext):
+    "search context that event loop coroutines can wait on"
+
+    def __init__(self, messageId, types=None, scopes=None):
+        super().__init__(messageId, types, scopes)
+        self._event = asyncio.Event()
+
+    def _found(self):
+        super()._found()
+        self._event.set()
+
+    async def _waitFor(self, predicate, timeout):
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        while not predicate():
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                return
+
+    async def wait(self, count, timeout):
+        """wait at most TIMEOUT seconds for the search to have found more than
+        COUNT services, then return the services found"""
+        await self._waitFor(lambda: len(self) > count, timeout)
+        return self.getServices()
+
+    async def waitReplied(self, timeout):
+        """wait at most TIMEOUT seconds for the first match message of the
+        search; returns True if it has arrived"""
+        await self._waitFor(lambda: self.firstReplyTime is not None, timeout)
+        return self.firstReplyTime is not None
+
+    async def waitResolved(self, timeout):
+        """wait at most TIMEOUT seconds for all services found to be resolved,
+        then return the services found"""
+        await self._waitFor(self.isResolved, timeout)
+        return self.getServices()
+
+
+class _ServiceIterator:
+    """asynchronous iterator over the services found by a search as they reply;
+    a class rather than an async generator, which Python 3.5 does not have"""
+
+    def __init__(self, wsd, search, timeout, maxResults, idleTimeout):
+        self._wsd = wsd
+        self._search = search
+        self._pending = collections.deque()
+        self._done = False
+        self._deadline = asyncio.get_event_loop().time() + timeout
+        self._maxResults = maxResults
+        self._idleTimeout = idleTimeout
+        self._found = 0
+        self._awaitedProxy = False
+
+        if search.cached:
+            self._pending.extend(search.getServices()[:maxResults])
+            self._done = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            while not self._pending and not self._done:
+                await self._fetch()
+        except BaseException:
+            self.close()
+            raise
+        if not self._pending:
+            self.close()
+            raise StopAsyncIteration
+        return self._pending.popleft()
+
+    async def _fetch(self):
+        "wait for more services to reply, or note that the search is done"
+        search = self._search
+        if not self._awaitedProxy:
+            await self._wsd._awaitProxy(search, self._deadline)
+            self._awaitedProxy = True
+
+        if self._maxResults is not None and self._found >= self._maxResults:
+            self._done = True
+            return
+        wait = self._deadline - asyncio.get_event_loop().time()
+        if self._idleTimeout is not None:
+            wait = min(wait, self._idleTimeout)
+        if wait <= 0:
+            self._timedOut()
+            return
+        services = await search.wait(self._found, wait)
+        if len(services) == self._found:
+            self._timedOut()
+            return
+        self._pending.extend(services[self._found:self._maxResults])
+        self._found = len(services)
+
+    def _timedOut(self):
+        "end a search that no more services replied to, noting whether it ran until its timeout"
+        self._search.complete = asyncio.get_event_loop().time() >= self._deadline
+        self._done = True
+
+    def close(self):
+        "end the search; no more services are yielded"
+        if self._search is not None:
+            self._wsd._endSearch(self._search)
+            self._search = None
+        self._pending.clear()
+        self._done = True
+
+    async def aclose(self):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+
+class AsyncWSDiscovery(Daemon, Discovery, AsyncNetworking):
+    "Full asyncio service discovery implementation"
+
+    _searchContextClass = AsyncSearchContext
+
+    def __init__(self, **kwargs):
+        self._expiryTimer = None
+        super().__init__(**kwargs)
+
+    async def start(self):
+        await AsyncNetworking.start(self)
+        if self._remoteServiceTTL is not None and self._expiryTimer is None:
+            self._scheduleExpiry()
+
+    def _scheduleExpiry(self):
+        loop = asyncio.get_event_loop()
+        self._expiryTimer = loop.call_later(self._getExpiryInterval(), self._expire)
+
+    def _expire(self):
+        self._expireRemoteServices()
+        self._scheduleExpiry()
+
+    def iterServices(self, types=None, scopes=None, address=None, port=None, timeout=3,
+                     maxResults=None, idleTimeout=None):
+        """search for services given the TYPES and SCOPES, yielding each matching
+        service as soon as it replies; the search ends after TIMEOUT seconds,
+        after MAXRESULTS services or when no new service has replied within
+        IDLETIMEOUT seconds. Gives an asynchronous iterator for ``async for``."""
+        search = self._startSearch(types, scopes, address, port)
+        return _ServiceIterator(self, search, timeout, maxResults, idleTimeout)
+
+    async def searchServices(self, types=None, scopes=None, address=None, port=None, timeout=3,
+                             resolveTimeout=RESOLVE_TIMEOUT):
+        """search for services given the TYPES and SCOPES in a given TIMEOUT;
+        gives the services that replied to this search, after waiting at most
+        RESOLVETIMEOUT seconds more for the addresses of services that replied
+        without them"""
+        search = self._startSearch(types, scopes, address, port)
+        try:
+            if not search.cached:
+                loop = asyncio.get_event_loop()
+                deadline = loop.time() + timeout
+                await self._awaitProxy(search, deadline)
+                await asyncio.sleep(max(deadline - loop.time(), 0))
+                await search.waitResolved(resolveTimeout)
+                search.complete = True
+        finally:
+            self._endSearch(search)
+
+        return search.getServices()
+
+    async def _awaitProxy(self, search, deadline):
+        "wait until the proxy of a search has answered, failing over to other proxies"
+        loop = asyncio.get_event_loop()
+        while search.proxy is not None:
+            wait = min(PROXY_TIMEOUT, deadline - loop.time())
+            if await search.waitReplied(wait) or wait < PROXY_TIMEOUT:
+                return
+            self._failOver(search)
+
+    async def probeTargets(self, targets, types=None, scopes=None, port=MULTICAST_PORT, timeout=3, rate=None):
+        """send directed probes for the TYPES and SCOPES to TARGETS - a host,
+        a network in CIDR notation or a list of these - at most RATE per
+        second, and collect the replies until TIMEOUT seconds after the last
+        probe was sent; gives a dict from target host to its search context"""
+        searches = {}
+        try:
+            for wait in self._startTargetSearches(targets, types, scopes, port, rate, searches):
+                await asyncio.sleep(wait)
+            await asyncio.sleep(max(self._getLastSendTime(searches) + timeout - time.monotonic(), 0))
+        finally:
+            self._endSearches(searches)
+        return searches
+
+    async def stop(self):
+        if self._expiryTimer is not None:
+            self._expiryTimer.cancel()
+            self._expiryTimer = None
+        self.clearRemoteServices()
+        self.clearProxies()
+        await AsyncNetworking.stop(self)
+
+
+class AsyncWSPublishing(AsyncNetworking, Publishing, Daemon):
+    "asyncio service publishing"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+    async def stop(self):
+        "send Bye messages for the published services, then stop networking"
+        if self._serverStarted:
+            self.clearLocalServices()
+        await AsyncNetworking.stop(self)
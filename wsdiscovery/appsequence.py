@@ -0,0 +1,53 @@
+"""Tracking of WS-Discovery application sequences for ordering announcements."""
+
+import threading
+
+from .cache import ExpiringCache
+
+
+APP_SEQUENCE_CACHE_SIZE = 4096
+APP_SEQUENCE_TTL = 600 # seconds
+
+
+class AppSequenceTracker:
+    """Highest message number seen per application sequence.
+
+    An application sequence is identified by the sender address along
+    with the InstanceId & SequenceId of the AppSequence header; instance
+    ids are often small boot counters, so they are only unique per
+    sender. A message that does not have a higher message number than
+    the newest message of its sequence is stale - a repeat, a replay or
+    reordered by the network - and should be ignored. Sequences that
+    have not been heard from for the time to live are forgotten.
+    """
+
+    def __init__(self, capacity=APP_SEQUENCE_CACHE_SIZE, ttl=APP_SEQUENCE_TTL):
+        self._sequences = ExpiringCache(capacity, ttl)
+        self._lock = threading.Lock()
+        self.stale = 0
+
+    def accept(self, sender, instanceId, sequenceId, messageNumber):
+        """record a message of an application sequence from SENDER; returns
+        False if the message is stale, and True if it is the newest one so far"""
+        try:
+            key = (sender, int(instanceId), sequenceId)
+            number = int(messageNumber)
+        except ValueError:
+            return True  # not sequenced, nothing to compare against
+
+        with self._lock:
+            last = self._sequences.get(key)
+            if last is not None and number <= last:
+                self.stale += 1
+                return False
+            self._sequences.set(key, number)
+            return True
+
+    def clear(self):
+        self._sequences.clear()
+
+    def getStats(self):
+        "get the sequence cache counters along with the number of stale messages"
+        stats = self._sequences.getStats()
+        stats["stale"] = self.stale
+        return stats
@@ -1 +0,0 @@
-"""A discovery daemon implementation using asyncio is planned."""
@@ -0,0 +1,310 @@
+"""Sending & receiving datagrams in batches.
+
+Every datagram sent or received normally takes a system call of its own.
+On Linux, sendmmsg() & recvmmsg() move a whole batch of datagrams in one
+call; the socket module does not expose them, so they are called through
+ctypes. Elsewhere, batches are sent & received one datagram at a time.
+Both implementations count the system calls made and the datagrams moved,
+so that the calls saved can be measured.
+"""
+
+import ctypes
+import functools
+import logging
+import os
+import socket
+import struct
+import sys
+
+from .transport import BUFFER_SIZE
+
+
+logger = logging.getLogger("batchio")
+
+
+# datagrams per sendmmsg() / recvmmsg() call; every one of them needs a
+# receive buffer of BUFFER_SIZE bytes
+BATCH_SIZE = 16
+
+MSG_DONTWAIT = 0x40
+
+_SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+_CMSGHDR = struct.Struct("@Nii")  # length, level, type
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p),
+                ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p),
+                ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(_IOVec)),
+                ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p),
+                ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", _MsgHdr),
+                ("msg_len", ctypes.c_uint)]
+
+
+@functools.lru_cache(maxsize=4096)
+def _packSockaddr(family, addr):
+    """pack a socket address as a struct sockaddr; gives None if it is not a
+    numeric address, e.g. a host name that still needs to be looked up"""
+    try:
+        if family == socket.AF_INET:
+            return struct.pack("=H", family) + \
+                   struct.pack("!H4s8x", addr[1], socket.inet_pton(socket.AF_INET, addr[0]))
+        if family == socket.AF_INET6:
+            host, scope = addr[0], addr[3] if len(addr) > 3 else 0
+            if "%" in host:
+                host, ifname = host.split("%", 1)
+                scope = int(ifname) if ifname.isdigit() else socket.if_nametoindex(ifname)
+            flowinfo = addr[2] if len(addr) > 2 else 0
+            return struct.pack("=H", family) + \
+                   struct.pack("!HI16s", addr[1], flowinfo, socket.inet_pton(socket.AF_INET6, host)) + \
+                   struct.pack("=I", scope)
+    except OSError:
+        pass
+    return None
+
+
+def _unpackSockaddr(data):
+    """unpack a struct sockaddr into an address tuple like recvfrom() gives;
+    the scope id of an IPv6 address is only in the tuple, not the host"""
+    family = struct.unpack_from("=H", data)[0]
+    if family == socket.AF_INET6:
+        port, flowinfo, addr = struct.unpack_from("!HI16s", data, 2)
+        scope = struct.unpack_from("=I", data, 24)[0]
+        return (socket.inet_ntop(socket.AF_INET6, addr), port, flowinfo, scope)
+    port, addr = struct.unpack_from("!H4s", data, 2)
+    return (socket.inet_ntoa(addr), port)
+
+
+@functools.lru_cache(maxsize=256)
+def _packControl(ancdata):
+    "pack ancillary data, a tuple of (level, type, data) tuples, like sendmsg() does"
+    control = b""
+    for level, kind, data in ancdata:
+        control += _CMSGHDR.pack(socket.CMSG_LEN(len(data)), level, kind) + data
+        control += bytes(socket.CMSG_SPACE(len(data)) - socket.CMSG_LEN(len(data)))
+    return control
+
+
+def _unpackControl(data):
+    "unpack received ancillary data into a list of (level, type, data) tuples like recvmsg() gives"
+    ancdata = []
+    offset = 0
+    while offset + _CMSGHDR.size <= len(data):
+        length, level, kind = _CMSGHDR.unpack_from(data, offset)
+        if length < _CMSGHDR.size:
+            break
+        ancdata.append((level, kind, bytes(data[offset + _CMSGHDR.size:offset + length])))
+        offset += socket.CMSG_SPACE(length - _CMSGHDR.size)
+    return ancdata
+
+
+class PortableBatchIO:
+    "send & receive batches of datagrams one datagram at a time"
+
+    name = "portable"
+
+    def __init__(self):
+        self._recvBuffer = bytearray(BUFFER_SIZE)
+        self._recvView = memoryview(self._recvBuffer)
+
+        self.sendCalls = 0
+        self.sentDatagrams = 0
+        self.recvCalls = 0
+        self.receivedDatagrams = 0
+
+    def _sendOne(self, sock, index, datagram, failed):
+        data, addr, ancdata = datagram
+        self.sendCalls += 1
+        try:
+            if ancdata:
+                sock.sendmsg([data], ancdata, 0, addr)
+            else:
+                sock.sendto(data, addr)
+        except socket.error as ex:
+            failed.append((index, ex))
+            return
+        self.sentDatagrams += 1
+
+    def sendBatch(self, sock, datagrams):
+        """send a list of (data, address, ancillary data or None) tuples through
+        the socket; gives a list of (index, error) for the datagrams that failed"""
+        failed = []
+        for index, datagram in enumerate(datagrams):
+            self._sendOne(sock, index, datagram, failed)
+        return failed
+
+    def recvBatch(self, sock, maxCount, ancBufSize=0):
+        """receive at most MAXCOUNT of the datagrams waiting in the socket as a
+        list of (data, address, ancillary data) tuples; with ANCBUFSIZE,
+        ancillary data up to that size is received too"""
+        received = []
+        while len(received) < maxCount:
+            self.recvCalls += 1
+            try:
+                if ancBufSize:
+                    nbytes, ancdata, flags, addr = sock.recvmsg_into([self._recvBuffer], ancBufSize)
+                else:
+                    nbytes, addr = sock.recvfrom_into(self._recvBuffer)
+                    ancdata = []
+            except socket.error:  # nothing more to read (or an ICMP error)
+                break
+            received.append((bytes(self._recvView[:nbytes]), addr, ancdata))
+        self.receivedDatagrams += len(received)
+        return received
+
+    def getStats(self):
+        """get the system calls made & datagrams moved; callsSaved is the
+        number of calls fewer than one per datagram"""
+        calls = self.sendCalls + self.recvCalls
+        datagrams = self.sentDatagrams + self.receivedDatagrams
+        return {"implementation": self.name,
+                "sendCalls": self.sendCalls, "sentDatagrams": self.sentDatagrams,
+                "recvCalls": self.recvCalls, "receivedDatagrams": self.receivedDatagrams,
+                "callsSaved": datagrams - calls}
+
+
+class MmsgBatchIO(PortableBatchIO):
+    "send & receive batches of datagrams with sendmmsg() & recvmmsg()"
+
+    name = "mmsg"
+
+    def __init__(self, libc, batchSize=BATCH_SIZE):
+        super(MmsgBatchIO, self).__init__()
+        self._batchSize = batchSize
+
+        self._sendmmsg = libc.sendmmsg
+        self._sendmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int]
+        self._sendmmsg.restype = ctypes.c_int
+        self._recvmmsg = libc.recvmmsg
+        self._recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(_MMsgHdr), ctypes.c_uint, ctypes.c_int,
+                                   ctypes.c_void_p]
+        self._recvmmsg.restype = ctypes.c_int
+
+        # receive buffers are allocated on first use, and again when more
+        # ancillary data space is needed
+        self._recvMsgs = None
+        self._recvAncBufSize = -1
+
+    def sendBatch(self, sock, datagrams):
+        failed = []
+        batch = []
+        for index, datagram in enumerate(datagrams):
+            if _packSockaddr(sock.family, datagram[1]) is None:  # e.g. a host name
+                self._sendOne(sock, index, datagram, failed)
+            else:
+                batch.append((index, datagram))
+
+        while batch:
+            sent = self._sendChunk(sock, batch[:self._batchSize])
+            if sent <= 0:  # the first datagram of the chunk failed; skip it
+                err = ctypes.get_errno()
+                failed.append((batch[0][0], OSError(err, os.strerror(err))))
+                sent = 1
+            batch = batch[sent:]
+        return failed
+
+    def _sendChunk(self, sock, chunk):
+        count = len(chunk)
+        msgs = (_MMsgHdr * count)()
+        iovs = (_IOVec * count)()
+        buffers = []  # the headers only point to these, so they are kept alive here
+        for i, (index, (data, addr, ancdata)) in enumerate(chunk):
+            name = _packSockaddr(sock.family, addr)
+            buffers.append(name)
+            iovs[i].iov_base = ctypes.cast(data, ctypes.c_void_p)
+            iovs[i].iov_len = len(data)
+            hdr = msgs[i].msg_hdr
+            hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+            hdr.msg_namelen = len(name)
+            hdr.msg_iov = ctypes.pointer(iovs[i])
+            hdr.msg_iovlen = 1
+            if ancdata:
+                control = _packControl(tuple(ancdata))
+                buffers.append(control)
+                hdr.msg_control = ctypes.cast(control, ctypes.c_void_p)
+                hdr.msg_controllen = len(control)
+
+        sent = self._sendmmsg(sock.fileno(), msgs, count, 0)
+        self.sendCalls += 1
+        if sent > 0:
+            self.sentDatagrams += sent
+        return sent
+
+    def _prepareRecv(self, ancBufSize):
+        "(re)allocate the receive buffers & headers, and reset the headers for the next call"
+        count = self._batchSize
+        if self._recvAncBufSize != ancBufSize:
+            self._recvMsgs = (_MMsgHdr * count)()
+            self._recvIovs = (_IOVec * count)()
+            self._recvData = (ctypes.c_char * (BUFFER_SIZE * count))()
+            self._recvNames = (ctypes.c_char * (_SOCKADDR_SIZE * count))()
+            self._recvControl = (ctypes.c_char * (max(ancBufSize, 1) * count))()
+            self._recvDataView = memoryview(self._recvData).cast("B")
+            self._recvNamesView = memoryview(self._recvNames).cast("B")
+            self._recvControlView = memoryview(self._recvControl).cast("B")
+            self._recvAncBufSize = ancBufSize
+
+            base = ctypes.addressof(self._recvData)
+            names = ctypes.addressof(self._recvNames)
+            control = ctypes.addressof(self._recvControl)
+            for i in range(count):
+                self._recvIovs[i].iov_base = base + i * BUFFER_SIZE
+                self._recvIovs[i].iov_len = BUFFER_SIZE
+                hdr = self._recvMsgs[i].msg_hdr
+                hdr.msg_name = names + i * _SOCKADDR_SIZE
+                hdr.msg_iov = ctypes.pointer(self._recvIovs[i])
+                hdr.msg_iovlen = 1
+                if ancBufSize:
+                    hdr.msg_control = control + i * ancBufSize
+
+        for i in range(count):
+            hdr = self._recvMsgs[i].msg_hdr
+            hdr.msg_namelen = _SOCKADDR_SIZE
+            hdr.msg_controllen = ancBufSize
+        return self._recvMsgs
+
+    def recvBatch(self, sock, maxCount, ancBufSize=0):
+        received = []
+        while len(received) < maxCount:
+            count = min(self._batchSize, maxCount - len(received))
+            msgs = self._prepareRecv(ancBufSize)
+            n = self._recvmmsg(sock.fileno(), msgs, count, MSG_DONTWAIT, None)
+            self.recvCalls += 1
+            if n <= 0:  # nothing more to read (or an ICMP error)
+                break
+
+            for i in range(n):
+                hdr = msgs[i].msg_hdr
+                data = self._recvDataView[i * BUFFER_SIZE:i * BUFFER_SIZE + msgs[i].msg_len]
+                addr = _unpackSockaddr(self._recvNamesView[i * _SOCKADDR_SIZE:(i + 1) * _SOCKADDR_SIZE])
+                ancdata = []
+                if ancBufSize:
+                    start = i * ancBufSize
+                    ancdata = _unpackControl(self._recvControlView[start:start + hdr.msg_controllen])
+                received.append((bytes(data), addr, ancdata))
+
+            if n < count:  # the socket has been drained
+                break
+        self.receivedDatagrams += len(received)
+        return received
+
+
+def createBatchIO():
+    "create the most efficient batch I/O implementation available on this platform"
+    if sys.platform.startswith("linux"):
+        try:
+            return MmsgBatchIO(ctypes.CDLL(None, use_errno=True))
+        except (OSError, AttributeError) as ex:
+            logger.debug("cannot send & receive with sendmmsg/recvmmsg: %s", ex)
+    return PortableBatchIO()
@@ -0,0 +1,99 @@
+"""Bounded, time-expiring cache used for duplicate detection & other bookkeeping."""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class ExpiringCache:
+    """Thread-safe mapping with a capacity and a time to live for its entries.
+
+    Entries expire TTL seconds after they were last set. When the cache is
+    full, the entries set longest ago are evicted first. Since all entries
+    live equally long, the entries are kept in expiry order, and expiring
+    and evicting are both done from the front of the queue.
+    """
+
+    def __init__(self, capacity, ttl, timer=time.monotonic):
+        self._capacity = capacity
+        self._ttl = ttl
+        self._timer = timer
+        self._entries = OrderedDict()  # key -> (expiry time, value), earliest expiry first
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def _expire(self, now):
+        entries = self._entries
+        while entries:
+            key, (expires, value) = next(iter(entries.items()))
+            if expires > now:
+                return
+            del entries[key]
+            self.expirations += 1
+
+    def _set(self, key, value, now):
+        self._entries.pop(key, None)
+        self._entries[key] = (now + self._ttl, value)
+        while len(self._entries) > self._capacity:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self):
+        with self._lock:
+            self._expire(self._timer())
+            return len(self._entries)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._expire(self._timer())
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value=True):
+        "set KEY to VALUE, restarting its time to live"
+        with self._lock:
+            now = self._timer()
+            self._expire(now)
+            self._set(key, value, now)
+
+    def add(self, key, value=True):
+        """set KEY to VALUE unless KEY is already in the cache; returns
+        True if the key was added and False if it was already there"""
+        with self._lock:
+            now = self._timer()
+            self._expire(now)
+            if key in self._entries:
+                self.hits += 1
+                return False
+            self.misses += 1
+            self._set(key, value, now)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def getStats(self):
+        "get the hit, miss, expiration & eviction counters along with the current size"
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "expirations": self.expirations, "evictions": self.evictions}
@@ -9,9 +9,11 @@ from .actions import *
 from .uri import URI
 from .service import Service
 from .envelope import SoapEnvelope
+from .transport import getReplyHost
 
 
 APP_MAX_DELAY = 500 # miliseconds
+MAX_PROBE_MATCHES_PER_MESSAGE = 32
 
 logger = logging.getLogger("daemon")
 
@@ -21,11 +23,6 @@ class Daemon:
 
     def __init__(self, uuid_=None, capture=None, ttl=1, **kwargs):
 
-        # track existence of a possible discovery proxy
-        self._dpActive = False
-        self._dpAddr = None
-        self._dpEPR = None
-
         if uuid_ is not None:
             self.uuid = uuid_
         else:
@@ -48,27 +45,28 @@ class Daemon:
 
     def _sendResolveMatch(self, service, relatesTo, addr):
         env = constructResolveMatch(service, relatesTo)
-        self.sendUnicastMessage(env, addr[0], addr[1])
+        self.sendUnicastMessage(env, getReplyHost(addr), addr[1])
 
     def _sendProbeMatch(self, services, relatesTo, addr):
-        env = constructProbeMatch(services, relatesTo)
-        self.sendUnicastMessage(env, addr[0], addr[1], random.randint(0, APP_MAX_DELAY))
+        # split large responses so that each message fits in a datagram
+        for i in range(0, max(len(services), 1), MAX_PROBE_MATCHES_PER_MESSAGE):
+            env = constructProbeMatch(services[i:i + MAX_PROBE_MATCHES_PER_MESSAGE], relatesTo)
+            self.sendUnicastMessage(env, getReplyHost(addr), addr[1], random.randint(0, APP_MAX_DELAY))
 
-    def _sendProbe(self, types=None, scopes=None, address=None, port=None):
+    def _sendProbe(self, types=None, scopes=None, address=None, port=None, initialDelay=0):
+        "send a Probe; returns its envelope, whose MessageID the matches relate to"
         env = constructProbe(types, scopes)
-        if self._dpActive:
-            self.sendUnicastMessage(env, self._dpAddr[0], self._dpAddr[1])
-        elif address and port:
-            self.sendUnicastMessage(env, address, port)
+        if address and port:
+            self.sendUnicastMessage(env, address, port, initialDelay)
         else:
             self.sendMulticastMessage(env)
+        return env
 
     def _sendResolve(self, epr):
+        "send a Resolve; returns its envelope, whose MessageID the matches relate to"
         env = constructResolve(epr)
-        if self._dpActive:
-            self.sendUnicastMessage(env, self._dpAddr[0], self._dpAddr[1])
-        else:
-            self.sendMulticastMessage(env)
+        self.sendMulticastMessage(env)
+        return env
 
     def _sendHello(self, service):
         env = constructHello(service)
@@ -76,7 +74,7 @@ class Daemon:
         self.sendMulticastMessage(env,initialDelay=random.randint(0, APP_MAX_DELAY))
 
     def _sendBye(self, service):
-        env = constructBye(service)
         service.incrementMessageNumber()
+        env = constructBye(service)
         self.sendMulticastMessage(env)
 
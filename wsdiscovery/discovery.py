@@ -1,22 +1,54 @@
 """Discovery application."""
 
 import time
-import uuid
+import threading
 
 from .actions import *
 from .uri import URI
-from .util import matchesFilter, filterServices, extractSoapUdpAddressFromURI
+from .util import matchesFilter, extractSoapUdpAddressFromURI
 from .service import Service
+from .registry import ServiceRegistry
+from .search import SearchContext, TargetSearchContext, iterTargets
+from .resolver import ResolveManager
+from .proxy import ProxyManager, PROXY_TIMEOUT
+from .transport import MULTICAST_PORT
 from .namespaces import NS_DISCOVERY
-from .threaded import ThreadedNetworking
+from .threaded import ThreadedNetworking, _StoppableDaemonThread
 from .daemon import Daemon
 
 
-class Discovery:
-    "networking-agnostic generic remote service discovery mixin"
+# default number of directed probes sent per second
+DIRECTED_PROBE_RATE = 200
 
-    def __init__(self, **kwargs):
-        self._remoteServices = {}
+# directed probes are queued this long before they are due, rather than all at once
+TARGET_PROBE_QUEUE_AHEAD = 0.1 # seconds
+
+# upper limit for the addresses one call of probeTargets may sweep (a /16 network)
+MAX_PROBE_TARGETS = 65536
+
+# default for how long a search waits for pending resolves after its timeout
+RESOLVE_TIMEOUT = 1 # seconds
+
+
+class Discovery:
+    """networking-agnostic generic remote service discovery mixin
+
+    Discovery proxies that announce themselves are used in managed mode:
+    probes & resolves are sent to the fastest healthy proxy instead of
+    being multicast, and the answers of proxies are cached for a while.
+    """
+
+    # the class of the contexts that collect the results of searches
+    _searchContextClass = SearchContext
+
+    def __init__(self, remoteServiceTTL=None, **kwargs):
+        self._remoteServices = ServiceRegistry()
+        self._remoteServiceTTL = remoteServiceTTL
+        self._remoteServiceDisappearedCallback = None
+        self._searches = {}  # probe MessageID -> search context
+        self._searchesLock = threading.Lock()
+        self._resolver = ResolveManager(self._sendManagedResolve)
+        self._proxies = ProxyManager()
         self._remoteServiceHelloCallback = None
         self._remoteServiceHelloCallbackTypesFilter = None
         self._remoteServiceHelloCallbackScopesFilter = None
@@ -50,33 +82,74 @@ class Discovery:
         Service uuid is passed as a parameter to the callback
         Set None to disable callback
         """
-        self._remoteServiceDisppearedCallback = cb
+        self._remoteServiceDisappearedCallback = cb
 
     # discovery-related message handlers:
 
+    def _getSearch(self, env):
+        "get the search that a match message relates to, if it is still ongoing"
+        with self._searchesLock:
+            return self._searches.get(env.getRelatesTo())
+
+    def _serviceFromMatch(self, match):
+        return self._getRemoteService(match.getEPR(), match.getTypes(), match.getScopes(),
+                                      match.getXAddrs(), match.getMetadataVersion())
+
+    def _getRemoteService(self, epr, types, scopes, xAddrs, metadataVersion):
+        """get the service a message describes: the known one if the message
+        does not change it, so that it is not rebuilt, or else a new one"""
+        known = self._remoteServices.get(epr)
+        if known is not None and self._isUnchanged(known, xAddrs, metadataVersion):
+            return known
+        service = Service(types, scopes, xAddrs, epr, 0)
+        service.setMetadataVersion(metadataVersion)
+        return service
+
+    @staticmethod
+    def _isUnchanged(known, xAddrs, metadataVersion):
+        "check whether a message with the XADDRS & METADATAVERSION leaves a known service as it is"
+        # types & scopes only change with the metadata version
+        return str(known.getMetadataVersion()) == str(metadataVersion) \
+               and (not xAddrs or xAddrs == known.getXAddrs())
+
+    def _updateRemoteService(self, service):
+        "keep track of a service seen in a message & pass its addresses on to searches waiting for them"
+        self._addRemoteService(service)
+        if service.getXAddrs():
+            for search in self._resolver.update(service):
+                search.add(service)
+
     def _handle_probematches(self, env, addr):
+        self._proxies.answered(env.getRelatesTo(), addr[0])
+        search = self._getSearch(env)
+        if search is not None:
+            search.replied()
+
         for match in env.getProbeResolveMatches():
-            self._addRemoteService(Service(match.getTypes(), match.getScopes(), match.getXAddrs(), match.getEPR(), 0))
-            if match.getXAddrs() is None or len(match.getXAddrs()) == 0:
-                self._sendResolve(match.getEPR())
+            service = self._serviceFromMatch(match)
+            if not service.getXAddrs():
+                service = self._resolver.resolve(service, search)
+            self._updateRemoteService(service)
+            if search is not None:
+                search.add(service)
 
     def _handle_resolvematches(self, env, addr):
         for match in env.getProbeResolveMatches():
-            self._addRemoteService(Service(match.getTypes(), match.getScopes(), match.getXAddrs(), match.getEPR(), 0))
+            self._updateRemoteService(self._serviceFromMatch(match))
 
     def _handle_hello(self, env, addr):
         #check if it is from a discovery proxy
         rt = env.getRelationshipType()
         if rt is not None and rt.getLocalname() == "Suppression" and rt.getNamespace() == NS_DISCOVERY:
-            xAddr = env.getXAddrs()[0]
             #only support 'soap.udp'
-            if xAddr.startswith("soap.udp:"):
-                self._dpActive = True
-                self._dpAddr = extractSoapUdpAddressFromURI(URI(xAddr))
-                self._dpEPR = env.getEPR()
-
-        service = Service(env.getTypes(), env.getScopes(), env.getXAddrs(), env.getEPR(), 0)
-        self._addRemoteService(service)
+            for xAddr in env.getXAddrs():
+                if xAddr.startswith("soap.udp:"):
+                    self._proxies.add(env.getEPR(), tuple(extractSoapUdpAddressFromURI(URI(xAddr))))
+                    break
+
+        service = self._getRemoteService(env.getEPR(), env.getTypes(), env.getScopes(),
+                                         env.getXAddrs(), env.getMetadataVersion())
+        self._updateRemoteService(service)
         if self._remoteServiceHelloCallback is not None:
             if matchesFilter(service,
                              self._remoteServiceHelloCallbackTypesFilter,
@@ -84,13 +157,11 @@ class Discovery:
                 self._remoteServiceHelloCallback(service)
 
     def _handle_bye(self, env, addr):
-        #if the bye is from discovery proxy... revert back to multicasting
-        if self._dpActive and self._dpEPR == env.getEPR():
-            self._dpActive = False
-            self._dpAddr = None
-            self._dpEPR = None
+        #if the bye is from discovery proxy... revert back to multicasting when it was the last one
+        self._proxies.remove(env.getEPR())
 
         self._removeRemoteService(env.getEPR())
+        self._resolver.invalidate(env.getEPR())
         if self._remoteServiceByeCallback is not None:
             self._remoteServiceByeCallback(env.getEPR())
 
@@ -106,39 +177,269 @@ class Discovery:
     # search for & keep track of discovered remote services:
 
     def _addRemoteService(self, service):
-        self._remoteServices[service.getEPR()] = service
+        known = self._remoteServices.get(service.getEPR())
+        if known is not None and self._isUnchanged(known, service.getXAddrs(), service.getMetadataVersion()):
+            self._remoteServices.touch(service.getEPR())
+        else:
+            self._remoteServices.add(service)
 
     def _removeRemoteService(self, epr):
-        if epr in self._remoteServices:
-            del self._remoteServices[epr]
+        self._remoteServices.remove(epr)
+
+    def _expireRemoteServices(self):
+        "forget the services that have not been heard of for the TTL & report them as disappeared"
+        if self._remoteServiceTTL is None:
+            return
+        for service in self._remoteServices.expire(self._remoteServiceTTL):
+            self._resolver.invalidate(service.getEPR())
+            if self._remoteServiceDisappearedCallback is not None:
+                self._remoteServiceDisappearedCallback(service.getEPR())
+
+    def _getExpiryInterval(self):
+        "seconds between checks for services that have gone silent"
+        return max(self._remoteServiceTTL / 4, 1)
+
+    def getRemoteServices(self, types=None, scopes=None):
+        """get the services discovered so far that match all of the given TYPES
+        and SCOPES, whichever search or announcement they were seen in"""
+        return self._remoteServices.search(types, scopes)
 
     def clearRemoteServices(self):
         'clears remotely discovered services'
 
         self._remoteServices.clear()
-
-    def searchServices(self, types=None, scopes=None, address=None, port=None, timeout=3):
-        'search for services given the TYPES and SCOPES in a given TIMEOUT'
+        self._resolver.clear()
+
+    # managed mode:
+
+    def getProxies(self):
+        "get the discovery proxies known, in the order they are preferred; without any, probes are multicast"
+        return self._proxies.getProxies()
+
+    def clearProxies(self):
+        "forget the discovery proxies known & their cached answers, so that probes are multicast again"
+        self._proxies.clear()
+
+    # Daemon precedes this mixin in the daemon classes, so its _sendProbe &
+    # _sendResolve cannot be overridden here; these route through proxies instead
+
+    def _sendManagedProbe(self, types=None, scopes=None, address=None, port=None):
+        "send a Probe, to a discovery proxy unless it is directed; returns its envelope"
+        if address and port:
+            return self._sendProbe(types, scopes, address, port)
+        env = constructProbe(types, scopes)
+        self._sendManaged(env)
+        return env
+
+    def _sendManagedResolve(self, epr):
+        "send a Resolve, to a discovery proxy if there is one; returns its envelope"
+        env = constructResolve(epr)
+        self._sendManaged(env)
+        return env
+
+    def _sendManaged(self, env, exclude=()):
+        """send a Probe or Resolve to the fastest healthy discovery proxy that
+        is not in EXCLUDE, or multicast it if there is none; gives the proxy"""
+        proxy = self._proxies.select(exclude)
+        if proxy is None:
+            self.sendMulticastMessage(env)
+            return None
+        if env.getAction() == NS_ACTION_PROBE:
+            self._proxies.probeSent(env.getMessageId(), proxy)
+        self.sendUnicastMessage(env, proxy.addr[0], proxy.addr[1])
+        return proxy
+
+    def _failOver(self, search):
+        """send the probe of a search, which its proxy did not answer in time,
+        to the next healthy proxy, or multicast it if there is none left"""
+        self._proxies.failed(search.messageId)
+        search.failedProxies.append(search.proxy)
+        search.proxy = self._sendManaged(search.probe, search.failedProxies)
+
+    def _awaitProxy(self, search, deadline):
+        "wait until the proxy of a search has answered, failing over to other proxies"
+        while search.proxy is not None:
+            wait = min(PROXY_TIMEOUT, deadline - time.monotonic())
+            if search.waitReplied(wait) or wait < PROXY_TIMEOUT:
+                return
+            self._failOver(search)
+
+    def _startSearch(self, types, scopes, address, port):
+        """send a probe & start collecting the matches relating to it; in managed
+        mode, a search that a proxy answered recently is answered from the cache"""
+        if not (address and port) and len(self._proxies):
+            services = self._proxies.getAnswer(types, scopes)
+            if services is not None:
+                search = self._searchContextClass(None, types, scopes)
+                search.cached = True
+                search.replied()
+                for service in services:
+                    search.add(service)
+                return search
+
+        # the lock keeps matches from being handled before the search is known
+        with self._searchesLock:
+            try:
+                env = self._sendManagedProbe(types, scopes, address, port)
+            except:
+                raise Exception("Server not started")
+            search = self._searchContextClass(env.getMessageId(), types, scopes)
+            search.probe = env
+            search.proxy = self._proxies.getProbeProxy(env.getMessageId())
+            self._searches[search.messageId] = search
+        return search
+
+    def _startTargetSearches(self, targets, types, scopes, port, rate, searches):
+        """send a directed probe to each of the TARGETS, at most RATE per second,
+        adding their search contexts to SEARCHES by target host; a generator
+        giving the seconds to sleep until more probes are due, so that only the
+        probes due within TARGET_PROBE_QUEUE_AHEAD are queued at a time"""
+        interval = 1.0 / (rate or DIRECTED_PROBE_RATE)
+        start = time.monotonic()
+        for i, target in enumerate(iterTargets(targets, MAX_PROBE_TARGETS)):
+            sendTime = start + i * interval
+            ahead = sendTime - time.monotonic()
+            if ahead > TARGET_PROBE_QUEUE_AHEAD:
+                yield ahead - TARGET_PROBE_QUEUE_AHEAD
+                ahead = sendTime - time.monotonic()
+            with self._searchesLock:
+                try:
+                    env = self._sendProbe(types, scopes, target, port, int(max(ahead, 0) * 1000))
+                except:
+                    raise Exception("Server not started")
+                search = TargetSearchContext(env.getMessageId(), types, scopes, target, sendTime)
+                self._searches[search.messageId] = search
+            searches[target] = search
+
+    @staticmethod
+    def _getLastSendTime(searches):
+        "get when the last of the directed probes of SEARCHES is sent"
+        return max([search.sendTime for search in searches.values()] or [time.monotonic()])
+
+    def _endSearches(self, searches):
+        for search in searches.values():
+            self._endSearch(search)
+
+    def probeTargets(self, targets, types=None, scopes=None, port=MULTICAST_PORT, timeout=3, rate=None):
+        """send directed probes for the TYPES and SCOPES to TARGETS - a host,
+        a network in CIDR notation or a list of these - at most RATE per
+        second, and collect the replies until TIMEOUT seconds after the last
+        probe was sent
+
+        Gives a dict from target host to its search context, which has the
+        services found (``getServices()``) and the reply latency in seconds,
+        or None if the target did not reply (``getLatency()``). Probes are
+        sent as they are due; targets spanning more than MAX_PROBE_TARGETS
+        addresses raise ValueError.
+        """
+        searches = {}
         try:
-            self._sendProbe(types, scopes, address, port)
-        except:
-            raise Exception("Server not started")
-
-        time.sleep(timeout)
+            for wait in self._startTargetSearches(targets, types, scopes, port, rate, searches):
+                time.sleep(wait)
+            time.sleep(max(self._getLastSendTime(searches) + timeout - time.monotonic(), 0))
+        finally:
+            self._endSearches(searches)
+        return searches
+
+    def _endSearch(self, search):
+        with self._searchesLock:
+            self._searches.pop(search.messageId, None)
+        # a search that was cut short has not seen the complete answer of the proxy
+        if search.proxy is not None and search.firstReplyTime is not None and search.complete:
+            self._proxies.setAnswer(search.types, search.scopes, search.getServices())
+
+    def iterServices(self, types=None, scopes=None, address=None, port=None, timeout=3,
+                     maxResults=None, idleTimeout=None):
+        """search for services given the TYPES and SCOPES, yielding each matching
+        service as soon as it replies; the search ends after TIMEOUT seconds,
+        after MAXRESULTS services or when no new service has replied within
+        IDLETIMEOUT seconds"""
+        search = self._startSearch(types, scopes, address, port)
+        try:
+            if search.cached:
+                yield from search.getServices()[:maxResults]
+                return
+
+            deadline = time.monotonic() + timeout
+            self._awaitProxy(search, deadline)
+            found = 0
+            while maxResults is None or found < maxResults:
+                wait = deadline - time.monotonic()
+                if idleTimeout is not None:
+                    wait = min(wait, idleTimeout)
+                if wait <= 0:
+                    break
+                services = search.wait(found, wait)
+                if len(services) == found:
+                    break
+                for service in services[found:maxResults]:
+                    yield service
+                found = len(services)
+            else:
+                return  # cut short at MAXRESULTS
+            search.complete = time.monotonic() >= deadline
+        finally:
+            self._endSearch(search)
+
+    def searchServices(self, types=None, scopes=None, address=None, port=None, timeout=3,
+                       resolveTimeout=RESOLVE_TIMEOUT):
+        """search for services given the TYPES and SCOPES in a given TIMEOUT;
+        gives the services that replied to this search, after waiting at most
+        RESOLVETIMEOUT seconds more for the addresses of services that replied
+        without them"""
+        search = self._startSearch(types, scopes, address, port)
+        try:
+            if not search.cached:
+                deadline = time.monotonic() + timeout
+                self._awaitProxy(search, deadline)
+                time.sleep(max(deadline - time.monotonic(), 0))
+                search.waitResolved(resolveTimeout)
+                search.complete = True
+        finally:
+            self._endSearch(search)
 
-        return filterServices(list(self._remoteServices.values()), types, scopes)
+        return search.getServices()
 
     def stop(self):
         self.clearRemoteServices()
+        self.clearProxies()
         super().stop()
 
 
+class RemoteServiceExpiryThread(_StoppableDaemonThread):
+    "periodically forget remote services that have gone silent"
+
+    def __init__(self, wsd):
+        super().__init__()
+        self._wsd = wsd
+
+    def run(self):
+        while not self._quitEvent.wait(self._wsd._getExpiryInterval()):
+            self._wsd._expireRemoteServices()
+
+
 class ThreadedWSDiscovery(Daemon, Discovery, ThreadedNetworking):
-    "Full threaded service discovery implementation"
+    """Full threaded service discovery implementation
+
+    With REMOTESERVICETTL, services that have not replied or announced
+    themselves for that many seconds are forgotten, and the disappeared
+    callback is called for them.
+    """
 
     def __init__(self, **kwargs):
+        self._expiryThread = None
         super().__init__(**kwargs)
 
+    def start(self):
+        super().start()
+        if self._remoteServiceTTL is not None and self._expiryThread is None:
+            self._expiryThread = RemoteServiceExpiryThread(self)
+            self._expiryThread.start()
+
     def stop(self):
+        if self._expiryThread is not None:
+            self._expiryThread.schedule_stop()
+            self._expiryThread.join()
+            self._expiryThread = None
         super().stop()
 
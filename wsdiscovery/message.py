@@ -1,9 +1,7 @@
 """Functions to serialize and deserialize messages between SOAP envelope & string representations"""
 
-import io
-from .namespaces import NS_ADDRESSING, NS_SOAPENV
 from .actions import *
-from xml.dom import minidom
+from .parser import parseMessage, ParseError
 
 
 def createSOAPMessage(env):
@@ -23,29 +21,21 @@ def createSOAPMessage(env):
         return createByeMessage(env)
 
 
-def parseSOAPMessage(data, ipAddr):
-    "deserialize XML message strings into SOAP envelope objects"
+_ACTIONS = (NS_ACTION_PROBE, NS_ACTION_PROBE_MATCH, NS_ACTION_RESOLVE,
+            NS_ACTION_RESOLVE_MATCH, NS_ACTION_BYE, NS_ACTION_HELLO)
+
+
+def parseSOAPMessage(data, ipAddr, headerFilter=None):
+    """deserialize XML message strings into SOAP envelope objects; faults,
+    unknown actions, messages that fail to parse & messages rejected by
+    HEADERFILTER give None"""
 
     try:
-        dom = minidom.parseString(data)
-    except Exception:
+        env = parseMessage(data, headerFilter)
+    except ParseError:
         #print('Failed to parse message from %s\n"%s": %s' % (ipAddr, data, ex), file=sys.stderr)
         return None
 
-    if dom.getElementsByTagNameNS(NS_SOAPENV, "Fault"):
-        #print('Fault received from %s:' % (ipAddr, data), file=sys.stderr)
+    if env is None or env.getAction() not in _ACTIONS:
         return None
-
-    soapAction = dom.getElementsByTagNameNS(NS_ADDRESSING, "Action")[0].firstChild.data.strip()
-    if soapAction == NS_ACTION_PROBE:
-        return parseProbeMessage(dom)
-    elif soapAction == NS_ACTION_PROBE_MATCH:
-        return parseProbeMatchMessage(dom)
-    elif soapAction == NS_ACTION_RESOLVE:
-        return parseResolveMessage(dom)
-    elif soapAction == NS_ACTION_RESOLVE_MATCH:
-        return parseResolveMatchMessage(dom)
-    elif soapAction == NS_ACTION_BYE:
-        return parseByeMessage(dom)
-    elif soapAction == NS_ACTION_HELLO:
-        return parseHelloMessage(dom)
+    return env
@@ -0,0 +1,211 @@
+"""Single-pass streaming parser for received WS-Discovery SOAP messages.
+
+The parser fills in a SOAP envelope object directly from expat callbacks,
+without building a document tree first.
+"""
+
+from xml.parsers import expat
+
+from .namespaces import NS_ADDRESSING, NS_DISCOVERY, NS_SOAPENV
+from .envelope import SoapEnvelope
+from .actions.probematch import ProbeResolveMatch
+from .qname import QName
+from .scope import Scope
+
+
+_SEP = " "
+
+
+def _name(ns, localname):
+    "expat name of an element in the given namespace"
+    return ns + _SEP + localname
+
+
+_ENVELOPE = _name(NS_SOAPENV, "Envelope")
+_HEADER = _name(NS_SOAPENV, "Header")
+_BODY = _name(NS_SOAPENV, "Body")
+_FAULT = _name(NS_SOAPENV, "Fault")
+
+_ACTION = _name(NS_ADDRESSING, "Action")
+_MESSAGE_ID = _name(NS_ADDRESSING, "MessageID")
+_RELATES_TO = _name(NS_ADDRESSING, "RelatesTo")
+_TO = _name(NS_ADDRESSING, "To")
+_REPLY_TO = _name(NS_ADDRESSING, "ReplyTo")
+_ENDPOINT_REFERENCE = _name(NS_ADDRESSING, "EndpointReference")
+_ADDRESS = _name(NS_ADDRESSING, "Address")
+
+_APP_SEQUENCE = _name(NS_DISCOVERY, "AppSequence")
+_TYPES = _name(NS_DISCOVERY, "Types")
+_SCOPES = _name(NS_DISCOVERY, "Scopes")
+_XADDRS = _name(NS_DISCOVERY, "XAddrs")
+_METADATA_VERSION = _name(NS_DISCOVERY, "MetadataVersion")
+_MATCHES = (_name(NS_DISCOVERY, "ProbeMatch"), _name(NS_DISCOVERY, "ResolveMatch"))
+
+_HEADER_TEXT_SETTERS = {
+    _ACTION: SoapEnvelope.setAction,
+    _MESSAGE_ID: SoapEnvelope.setMessageId,
+    _RELATES_TO: SoapEnvelope.setRelatesTo,
+    _TO: SoapEnvelope.setTo,
+    _REPLY_TO: SoapEnvelope.setReplyTo,
+}
+
+
+class ParseError(Exception):
+    "raised when a message is not a usable WS-Discovery SOAP message"
+
+
+class _Dropped(Exception):
+    "raised to stop parsing a message rejected by its headers"
+
+
+class _Match:
+    "fields of a ProbeMatch or ResolveMatch element being parsed"
+
+    def __init__(self):
+        self.epr = ""
+        self.types = []
+        self.scopes = []
+        self.xAddrs = []
+        self.metadataVersion = "1"
+
+
+class _MessageHandler:
+    "expat callbacks that fill in a SOAP envelope"
+
+    def __init__(self, headerFilter=None):
+        self.env = SoapEnvelope()
+        self._headerFilter = headerFilter
+        self._path = []         # names of the currently open elements
+        self._texts = []        # character data of the currently open elements
+        self._namespaces = {}   # prefix -> declared namespaces, innermost last
+        self._match = None
+        self._matchBy = ""
+
+    def _getNamespace(self, prefix):
+        uris = self._namespaces.get(prefix)
+        return uris[-1] if uris else ""
+
+    def _getQName(self, value):
+        "resolve a prefixed value using the namespace declarations in scope"
+        prefix, sep, localname = value.partition(":")
+        if not sep:
+            return QName(self._getNamespace(None), value)
+        return QName(self._getNamespace(prefix), localname, prefix)
+
+    def startNamespaceDecl(self, prefix, uri):
+        self._namespaces.setdefault(prefix, []).append(uri)
+
+    def endNamespaceDecl(self, prefix):
+        self._namespaces[prefix].pop()
+
+    def startDoctypeDecl(self, *args):
+        raise ParseError("DTDs are not allowed in SOAP messages")
+
+    def characterData(self, data):
+        self._texts[-1].append(data)
+
+    def startElement(self, name, attrs):
+        self._path.append(name)
+        self._texts.append([])
+
+        if name == _FAULT:
+            raise ParseError("SOAP fault")
+        elif name == _APP_SEQUENCE:
+            self.env.setInstanceId(attrs.get("InstanceId", ""))
+            self.env.setSequenceId(attrs.get("SequenceId", ""))
+            self.env.setMessageNumber(attrs.get("MessageNumber", ""))
+        elif name == _RELATES_TO and "RelationshipType" in attrs:
+            self.env.setRelationshipType(self._getQName(attrs["RelationshipType"]))
+        elif name == _SCOPES:
+            self._matchBy = attrs.get("MatchBy", "")
+        elif name in _MATCHES:
+            self._match = _Match()
+
+    def endElement(self, name):
+        text = "".join(self._texts.pop()).strip()
+        self._path.pop()
+
+        if name == _HEADER and len(self._path) == 1:
+            if self._headerFilter is not None and not self._headerFilter(self.env):
+                raise _Dropped()
+            return
+
+        if len(self._path) == 2 and self._path[1] == _HEADER:
+            setter = _HEADER_TEXT_SETTERS.get(name)
+            if setter is not None:
+                setter(self.env, text)
+            return
+
+        if len(self._path) < 2 or self._path[1] != _BODY:
+            return
+
+        target = self._match
+        if name == _ADDRESS:
+            if self._path[-1] == _ENDPOINT_REFERENCE:
+                if target is not None:
+                    target.epr = text
+                else:
+                    self.env.setEPR(text)
+        elif name == _TYPES:
+            types = [self._getQName(item) for item in _splitList(text)]
+            if target is not None:
+                target.types = types
+            else:
+                self.env.setTypes(types)
+        elif name == _SCOPES:
+            scopes = [Scope(item, self._matchBy) for item in _splitList(text)]
+            if target is not None:
+                target.scopes = scopes
+            else:
+                self.env.setScopes(scopes)
+        elif name == _XADDRS:
+            if target is not None:
+                target.xAddrs = _splitList(text)
+            else:
+                self.env.setXAddrs(_splitList(text))
+        elif name == _METADATA_VERSION:
+            if target is not None:
+                target.metadataVersion = text
+            else:
+                self.env.setMetadataVersion(text)
+        elif name in _MATCHES:
+            self.env.getProbeResolveMatches().append(
+                ProbeResolveMatch(target.epr, target.types, target.scopes,
+                                  target.xAddrs, target.metadataVersion))
+            self._match = None
+
+
+def _splitList(text):
+    return [item.replace('%20', ' ') for item in text.split()]
+
+
+def parseMessage(data, headerFilter=None):
+    """parse a received XML message into a SOAP envelope object in a single
+    pass; raises ParseError for faults & messages that cannot be used
+
+    HEADERFILTER is called with the envelope once its headers have been
+    parsed; if it returns False, the body is not parsed and None is returned.
+    """
+
+    handler = _MessageHandler(headerFilter)
+
+    parser = expat.ParserCreate(namespace_separator=_SEP)
+    parser.buffer_text = True
+    parser.StartNamespaceDeclHandler = handler.startNamespaceDecl
+    parser.EndNamespaceDeclHandler = handler.endNamespaceDecl
+    parser.StartDoctypeDeclHandler = handler.startDoctypeDecl
+    parser.StartElementHandler = handler.startElement
+    parser.EndElementHandler = handler.endElement
+    parser.CharacterDataHandler = handler.characterData
+
+    try:
+        parser.Parse(data, True)
+    except _Dropped:
+        return None
+    except Exception as ex:  # malformed XML, unknown encodings, bad values...
+        raise ParseError(str(ex))
+
+    env = handler.env
+    if not env.getAction() or not env.getMessageId():
+        raise ParseError("Action or MessageID missing")
+    return env
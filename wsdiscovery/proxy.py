@@ -0,0 +1,173 @@
+"""Tracking of discovery proxies for searching in managed mode.
+
+A discovery proxy announces itself with a Hello that has a Suppression
+relationship. While proxies are known, probes & resolves are sent to one
+of them instead of being multicast, so that large networks are spared
+multicast traffic. Probes go to the fastest healthy proxy; a proxy that
+leaves probes unanswered is skipped for a while, and when no proxy is
+healthy, probes are multicast again.
+"""
+
+import threading
+import time
+
+from .cache import ExpiringCache
+
+
+# how long a proxy may take to answer a probe before the next proxy is tried
+PROXY_TIMEOUT = 1 # seconds
+
+# unanswered probes after which a proxy is skipped, and for how long
+PROXY_FAILURE_LIMIT = 2
+PROXY_RETRY_INTERVAL = 30 # seconds
+
+# weight of the newest reply latency in a proxy's average latency
+LATENCY_WEIGHT = 0.25
+
+PROXY_ANSWER_CACHE_SIZE = 256
+PROXY_ANSWER_CACHE_TTL = 30 # seconds
+
+# probes to proxies are timed until they are answered or this old
+PENDING_PROBE_CACHE_SIZE = 4096
+PENDING_PROBE_TTL = 10 # seconds
+
+
+class DiscoveryProxy:
+    "a discovery proxy with its address, average reply latency & failure count"
+
+    def __init__(self, epr, addr):
+        self.epr = epr
+        self.addr = addr
+        self.latency = None # seconds, None until it has answered
+        self.failures = 0   # consecutive unanswered probes
+        self.lastFailure = None
+
+    def isHealthy(self, now):
+        "check whether probes may be sent to the proxy"
+        return self.failures < PROXY_FAILURE_LIMIT or now - self.lastFailure >= PROXY_RETRY_INTERVAL
+
+    def _answered(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += LATENCY_WEIGHT * (latency - self.latency)
+        self.failures = 0
+
+    def _failed(self, now):
+        self.failures += 1
+        self.lastFailure = now
+
+    def __repr__(self):
+        return "DiscoveryProxy(%s, %s:%s, latency=%s, failures=%i)" % \
+               (self.epr, self.addr[0], self.addr[1], self.latency, self.failures)
+
+
+def _answerKey(types, scopes):
+    return (tuple(sorted(repr(t) for t in types or ())),
+            tuple(sorted(repr(s) for s in scopes or ())))
+
+
+class ProxyManager:
+    """The discovery proxies known, the probes sent to them & their answers.
+
+    Proxies that have not answered yet are tried before the ones that
+    have, so that the latency of every proxy gets measured. The services a
+    proxy answered a search with are cached for the types & scopes searched
+    for; the cache is cleared when a proxy comes or goes.
+    """
+
+    def __init__(self, timer=time.monotonic):
+        self._proxies = {}  # EPR -> proxy
+        self._pending = ExpiringCache(PENDING_PROBE_CACHE_SIZE, PENDING_PROBE_TTL, timer)  # MessageID -> (proxy, send time)
+        self._answers = ExpiringCache(PROXY_ANSWER_CACHE_SIZE, PROXY_ANSWER_CACHE_TTL, timer)
+        self._timer = timer
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._proxies)
+
+    def add(self, epr, addr):
+        "note a proxy that announced itself; gives True if it was not known at that address"
+        with self._lock:
+            known = self._proxies.get(epr)
+            if known is not None and known.addr == addr:
+                return False
+            self._proxies[epr] = DiscoveryProxy(epr, addr)
+            self._answers.clear()
+            return True
+
+    def remove(self, epr):
+        "forget a proxy that said Bye; gives True if it was known"
+        with self._lock:
+            if self._proxies.pop(epr, None) is None:
+                return False
+            self._answers.clear()
+            return True
+
+    def getProxies(self):
+        "get the proxies known, the ones without a measured latency first and then the fastest"
+        with self._lock:
+            return sorted(self._proxies.values(), key=self._rank)
+
+    @staticmethod
+    def _rank(proxy):
+        return (proxy.latency is not None, proxy.latency or 0)
+
+    def select(self, exclude=()):
+        "get the fastest healthy proxy that is not excluded, or None if there is none"
+        now = self._timer()
+        with self._lock:
+            candidates = [proxy for proxy in self._proxies.values()
+                          if proxy not in exclude and proxy.isHealthy(now)]
+            return min(candidates, key=self._rank) if candidates else None
+
+    def probeSent(self, messageId, proxy):
+        "note a probe sent to a proxy, to time its answer"
+        self._pending.set(messageId, (proxy, self._timer()))
+
+    def getProbeProxy(self, messageId):
+        "get the proxy a probe is waiting for an answer from, or None"
+        pending = self._pending.get(messageId)
+        return pending[0] if pending is not None else None
+
+    def answered(self, messageId, host):
+        """note an answer to a probe from HOST; gives the proxy it was sent to,
+        or None if the probe is not pending or was sent to another proxy, as
+        it is when a proxy answers after the probe failed over"""
+        pending = self._pending.get(messageId)
+        if pending is None or pending[0].addr[0] != host:
+            return None
+        self._pending.pop(messageId)
+        proxy, sendTime = pending
+        with self._lock:
+            proxy._answered(max(self._timer() - sendTime, 0))
+        return proxy
+
+    def failed(self, messageId):
+        "note that a probe was not answered in time; gives the proxy it was sent to, or None"
+        pending = self._pending.pop(messageId)
+        if pending is None:
+            return None
+        proxy = pending[0]
+        with self._lock:
+            proxy._failed(self._timer())
+        return proxy
+
+    def getAnswer(self, types, scopes):
+        "get the services a proxy answered a search for the TYPES & SCOPES with, or None"
+        return self._answers.get(_answerKey(types, scopes))
+
+    def setAnswer(self, types, scopes, services):
+        "cache the services a proxy answered a search for the TYPES & SCOPES with"
+        self._answers.set(_answerKey(types, scopes), list(services))
+
+    def clear(self):
+        with self._lock:
+            self._proxies.clear()
+            self._pending.clear()
+            self._answers.clear()
+
+    def getStats(self):
+        "get the counters of the pending probe & answer caches"
+        return {"proxies": len(self._proxies), "pending": self._pending.getStats(),
+                "answers": self._answers.getStats()}
@@ -7,8 +7,9 @@ import uuid
 
 from .actions import *
 from .uri import URI
-from .util import filterServices, _generateInstanceId
+from .util import _generateInstanceId
 from .service import Service
+from .registry import ServiceRegistry
 from .threaded import ThreadedNetworking
 from .daemon import Daemon
 
@@ -17,34 +18,47 @@ class Publishing:
     "networking-agnostic generic service publishing mixin"
 
     def __init__(self, **kwargs):
-        self._localServices = {}
+        self._localServices = ServiceRegistry()
+        self._networkAddrs = []  # local addresses, in the order they appeared
         super().__init__(**kwargs)
 
     def _handle_probe(self, env, addr):
         "handle NS_ACTION_PROBE"
-        services = filterServices(list(self._localServices.values()), env.getTypes(), env.getScopes())
+        services = self._localServices.search(env.getTypes(), env.getScopes())
         self._sendProbeMatch(services, env.getMessageId(), addr)
 
     def _handle_resolve(self, env, addr):
         "handle NS_ACTION_RESOLVE"
         if env.getEPR() in self._localServices:
-            service = self._localServices[env.getEPR()]
+            service = self._localServices.get(env.getEPR())
             self._sendResolveMatch(service, env.getMessageId(), addr)
 
 
+    def _setNetworkAddrs(self, addrs):
+        self._networkAddrs = addrs
+        for service in self._localServices.values():
+            service.setNetworkAddrs(addrs)
+
     def  _networkAddressAdded(self, addr):
+        self._setNetworkAddrs(self._networkAddrs + [addr])
         self.addSourceAddr(addr)
         for service in list(self._localServices.values()):
             self._sendHello(service)
 
     def _networkAddressRemoved(self, addr):
+        self._setNetworkAddrs([a for a in self._networkAddrs if a != addr])
         self.removeSourceAddr(addr)
 
 
-    def publishService(self, types, scopes, xAddrs):
+    def publishService(self, types, scopes, xAddrs, epr=None):
         """Publish a service with the given TYPES, SCOPES and XAddrs (service addresses)
 
         if xAddrs contains item, which includes {ip} pattern, one item per IP address will be sent
+
+        The service endpoint reference EPR defaults to the uuid of the publisher;
+        give each service its own EPR to publish more than one service.
+        Publishing a service with the EPR of an already published one replaces it.
+        The published service is returned.
         """
 
         if not self._serverStarted:
@@ -52,10 +66,19 @@ class Publishing:
 
         instanceId = _generateInstanceId()
 
-        service = Service(types, scopes, xAddrs, self.uuid, instanceId)
-        self._localServices[self.uuid] = service
+        service = Service(types, scopes, xAddrs, epr or self.uuid, instanceId)
+        service.setNetworkAddrs(self._networkAddrs)
+        self._localServices.add(service)
         self._sendHello(service)
+        return service
 
+    def unpublishService(self, epr):
+        "send a Bye message for the service with the given EPR and remove it"
+
+        service = self._localServices.get(epr)
+        if service is not None:
+            self._sendBye(service)
+            self._localServices.remove(epr)
 
     def clearLocalServices(self):
         'send Bye messages for the services and remove them'
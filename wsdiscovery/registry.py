@@ -0,0 +1,220 @@
+"""Service registry indexed by type and scope for fast service lookups."""
+
+import threading
+import time
+from collections import OrderedDict
+
+from .util import filterServices, parseScopeURI, MATCH_BY_STRCMP, MATCH_BY_URI_RULES
+
+
+class _ScopeTrie:
+    "services indexed by the path segments of their scope URIs"
+
+    def __init__(self):
+        self._children = {}
+        self._eprs = set()
+
+    def add(self, segments, epr):
+        node = self
+        for segment in segments:
+            node = node._children.setdefault(segment, _ScopeTrie())
+        node._eprs.add(epr)
+
+    def remove(self, segments, epr):
+        if not segments:
+            self._eprs.discard(epr)
+            return
+        child = self._children.get(segments[0])
+        if child is None:
+            return
+        child.remove(segments[1:], epr)
+        if not child._eprs and not child._children:
+            del self._children[segments[0]]
+
+    def isEmpty(self):
+        return not self._eprs and not self._children
+
+    def collect(self, segments):
+        "get the services whose scope paths start with the given segments"
+        node = self
+        for segment in segments:
+            node = node._children.get(segment)
+            if node is None:
+                return set()
+        result = set()
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            result.update(node._eprs)
+            stack.extend(node._children.values())
+        return result
+
+
+def _getScopeKey(value):
+    """split a scope into its trie key & path segments; a trailing slash is
+    dropped, so that the segments of a probe scope are a prefix of the
+    segments of every scope it can match"""
+    scheme, authority, path = parseScopeURI(value)
+    segments = path.split("/")
+    if len(segments) > 1 and segments[-1] == "":
+        segments.pop()
+    return (scheme, authority), segments
+
+
+class ServiceRegistry:
+    """Services keyed by EPR, with indexes on type names & scopes.
+
+    The indexes narrow down the candidates for a search; the candidates are
+    then checked with the same matching rules as ``filterServices``, so
+    search results are identical to filtering all services.
+
+    The registry also keeps track of when each service was last seen, so
+    that services that have gone silent can be expired. It can be used from
+    several threads.
+    """
+
+    def __init__(self, timer=time.monotonic):
+        self._timer = timer
+        self._lock = threading.RLock()
+        self._services = {}
+        self._lastSeen = OrderedDict() # EPR -> time last seen, least recently seen first
+        self._byType = {}       # type fullname -> EPRs
+        self._byScope = {}      # (scheme, authority) -> _ScopeTrie
+        self._byScopeValue = {} # exact scope value -> EPRs
+
+    def __len__(self):
+        return len(self._services)
+
+    def __contains__(self, epr):
+        return epr in self._services
+
+    def __iter__(self):
+        return iter(self._services)
+
+    def get(self, epr, default=None):
+        return self._services.get(epr, default)
+
+    def values(self):
+        with self._lock:
+            return list(self._services.values())
+
+    def getLastSeen(self, epr):
+        "get the time the service with the given EPR was last seen, or None if it is not known"
+        return self._lastSeen.get(epr)
+
+    def touch(self, epr):
+        "note that the service with the given EPR has been seen"
+        with self._lock:
+            if epr in self._services:
+                self._lastSeen[epr] = self._timer()
+                self._lastSeen.move_to_end(epr)
+
+    def add(self, service):
+        "add a service, replacing any service with the same EPR"
+        with self._lock:
+            self._add(service)
+
+    def _add(self, service):
+        epr = service.getEPR()
+        if epr in self._services:
+            self._remove(epr)
+        self._services[epr] = service
+        self._lastSeen[epr] = self._timer()
+
+        for ttype in service.getTypes() or []:
+            self._byType.setdefault(ttype.getFullname(), set()).add(epr)
+
+        for scope in service.getScopes() or []:
+            value = scope.getValue()
+            self._byScopeValue.setdefault(value, set()).add(epr)
+            key, segments = _getScopeKey(value)
+            self._byScope.setdefault(key, _ScopeTrie()).add(segments, epr)
+
+    def remove(self, epr):
+        "remove the service with the given EPR, if there is one"
+        with self._lock:
+            self._remove(epr)
+
+    def _remove(self, epr):
+        service = self._services.pop(epr, None)
+        if service is None:
+            return
+        del self._lastSeen[epr]
+
+        for ttype in service.getTypes() or []:
+            self._discard(self._byType, ttype.getFullname(), epr)
+
+        for scope in service.getScopes() or []:
+            value = scope.getValue()
+            self._discard(self._byScopeValue, value, epr)
+            key, segments = _getScopeKey(value)
+            trie = self._byScope.get(key)
+            if trie is not None:
+                trie.remove(segments, epr)
+                if trie.isEmpty():
+                    del self._byScope[key]
+
+    @staticmethod
+    def _discard(index, key, epr):
+        eprs = index.get(key)
+        if eprs is not None:
+            eprs.discard(epr)
+            if not eprs:
+                del index[key]
+
+    def expire(self, maxAge):
+        "remove the services last seen more than MAXAGE seconds ago & give them"
+        before = self._timer() - maxAge
+        expired = []
+        with self._lock:
+            while self._lastSeen:
+                epr, seen = next(iter(self._lastSeen.items()))
+                if seen >= before:
+                    break
+                expired.append(self._services[epr])
+                self._remove(epr)
+        return expired
+
+    def clear(self):
+        with self._lock:
+            self._services.clear()
+            self._lastSeen.clear()
+            self._byType.clear()
+            self._byScope.clear()
+            self._byScopeValue.clear()
+
+    def _getScopeCandidates(self, scope):
+        matchBy = scope.getMatchBy()
+        if not matchBy or matchBy in MATCH_BY_URI_RULES:
+            key, segments = _getScopeKey(scope.getValue())
+            trie = self._byScope.get(key)
+            return trie.collect(segments) if trie is not None else set()
+        elif matchBy == MATCH_BY_STRCMP:
+            return self._byScopeValue.get(scope.getValue(), set())
+        else:
+            return set()
+
+    def search(self, types=None, scopes=None):
+        "get the services that match all of the given TYPES and SCOPES"
+        with self._lock:
+            return self._search(types, scopes)
+
+    def _search(self, types, scopes):
+        candidateSets = []
+        for ttype in types or []:
+            candidateSets.append(self._byType.get(ttype.getFullname(), set()))
+        for scope in scopes or []:
+            candidateSets.append(self._getScopeCandidates(scope))
+
+        if not candidateSets:
+            return filterServices(list(self._services.values()), types, scopes)
+
+        candidateSets.sort(key=len)
+        candidates = set(candidateSets[0])
+        for eprs in candidateSets[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(eprs)
+
+        services = [self._services[epr] for epr in candidates]
+        return filterServices(services, types, scopes)
@@ -0,0 +1,75 @@
+"""Coalescing & caching of Resolves for services found without addresses."""
+
+import threading
+
+from .cache import ExpiringCache
+from .udp import RETRANSMISSION_WINDOW
+
+
+RESOLVE_CACHE_SIZE = 4096
+RESOLVE_CACHE_TTL = 300 # seconds
+
+# how long to wait for a ResolveMatch before a Resolve may be sent again
+PENDING_RESOLVE_TTL = RETRANSMISSION_WINDOW / 1000 + 1 # seconds
+
+
+class ResolveManager:
+    """Keep track of the addresses of remote services & the Resolves sent for them.
+
+    At most one Resolve is pending for an EPR at a time; searches that find
+    a service without addresses while its Resolve is pending wait for the
+    same ResolveMatch. Addresses learned from matches & Hellos are cached
+    per EPR, so services found again are not resolved again. A cached entry
+    is dropped when the service says Bye, when it reappears with another
+    metadata version or when it has not been seen for the time to live.
+    """
+
+    def __init__(self, sendResolve, capacity=RESOLVE_CACHE_SIZE, ttl=RESOLVE_CACHE_TTL):
+        self._sendResolve = sendResolve
+        self._resolved = ExpiringCache(capacity, ttl)                 # EPR -> service with addresses
+        self._pending = ExpiringCache(capacity, PENDING_RESOLVE_TTL)  # EPR -> waiting searches
+        self._lock = threading.Lock()
+
+    def resolve(self, service, search=None):
+        """get a service found without addresses with the addresses known for
+        the same metadata version; otherwise resolve it and give the service
+        as is - SEARCH, if given, is updated when the ResolveMatch arrives"""
+        epr = service.getEPR()
+        with self._lock:
+            cached = self._resolved.get(epr)
+            if cached is not None:
+                if str(cached.getMetadataVersion()) == str(service.getMetadataVersion()):
+                    return cached
+                self._resolved.pop(epr)
+
+            searches = self._pending.get(epr)
+            if searches is None:
+                searches = []
+                self._pending.set(epr, searches)
+                self._sendResolve(epr)
+            if search is not None and search not in searches:
+                searches.append(search)
+            return service
+
+    def update(self, service):
+        """note a remote service seen in a message with its addresses; gives
+        the searches that were waiting for them"""
+        epr = service.getEPR()
+        with self._lock:
+            self._resolved.set(epr, service)
+            return self._pending.pop(epr, [])
+
+    def invalidate(self, epr):
+        "forget the addresses of the service with the given EPR"
+        with self._lock:
+            self._resolved.pop(epr)
+            self._pending.pop(epr)
+
+    def clear(self):
+        with self._lock:
+            self._resolved.clear()
+            self._pending.clear()
+
+    def getStats(self):
+        "get the counters of the resolved service & pending resolve caches"
+        return {"resolved": self._resolved.getStats(), "pending": self._pending.getStats()}
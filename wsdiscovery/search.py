@@ -0,0 +1,153 @@
+"""Tracking of the services found by an ongoing search."""
+
+import collections
+import ipaddress
+import threading
+import time
+
+from .util import matchesFilter
+
+
+class SearchContext:
+    """Services found by one search, in the order they were found.
+
+    A search is identified by the MessageID of its probe. The matches
+    relating to the probe are added to the context as they arrive; services
+    that do not match the types & scopes searched for are ignored. Services
+    found without addresses are replaced when they have been resolved. A
+    consumer can wait for more services to be found, or for all services
+    to be resolved.
+
+    In managed mode, the probe is sent to a discovery proxy, which is
+    recorded along with the proxies that did not answer it in time. A
+    search answered from the cache of proxy answers has sent no probe.
+    """
+
+    def __init__(self, messageId, types=None, scopes=None):
+        self.messageId = messageId
+        self.types = types
+        self.scopes = scopes
+        self._services = collections.OrderedDict()  # EPR -> service, in the order found
+        self._unresolved = set() # EPRs of services found without addresses
+        self._cond = threading.Condition()
+        self.firstReplyTime = None
+
+        self.probe = None        # the probe sent, for sending it to another proxy
+        self.proxy = None        # the discovery proxy the probe was sent to, if any
+        self.failedProxies = []  # the proxies that did not answer the probe in time
+        self.cached = False      # whether the services are a cached proxy answer
+        self.complete = False    # whether the search ran until its timeout, without a result limit
+
+    def replied(self):
+        "note that a match message for the search has arrived"
+        if self.firstReplyTime is None:
+            with self._cond:
+                self.firstReplyTime = time.monotonic()
+                self._found()
+
+    def __len__(self):
+        return len(self._services)
+
+    def add(self, service):
+        """add a found or resolved service; returns True if the search had not
+        found it yet"""
+        if not matchesFilter(service, self.types, self.scopes):
+            return False
+        epr = service.getEPR()
+        with self._cond:
+            new = epr not in self._services
+            if service.getXAddrs():
+                self._unresolved.discard(epr)
+            elif new:
+                self._unresolved.add(epr)
+            elif epr not in self._unresolved:
+                return False  # keep the addresses already known
+            self._services[epr] = service
+            self._found()
+            return new
+
+    def _found(self):
+        "wake up consumers waiting for services; called with the lock held"
+        self._cond.notify_all()
+
+    def getServices(self):
+        "get the services found so far"
+        with self._cond:
+            return list(self._services.values())
+
+    def isResolved(self):
+        "check whether all services found have addresses"
+        return not self._unresolved
+
+    def wait(self, count, timeout):
+        """wait at most TIMEOUT seconds for the search to have found more than
+        COUNT services, then return the services found"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._services) > count, timeout)
+            return list(self._services.values())
+
+    def waitReplied(self, timeout):
+        """wait at most TIMEOUT seconds for the first match message of the
+        search; returns True if it has arrived"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.firstReplyTime is not None, timeout)
+
+    def waitResolved(self, timeout):
+        """wait at most TIMEOUT seconds for all services found to be resolved,
+        then return the services found"""
+        with self._cond:
+            self._cond.wait_for(self.isResolved, timeout)
+            return list(self._services.values())
+
+
+class TargetSearchContext(SearchContext):
+    "search context of a probe directed to a single host, which times the first reply"
+
+    def __init__(self, messageId, types=None, scopes=None, target=None, sendTime=None):
+        super().__init__(messageId, types, scopes)
+        self.target = target
+        self.sendTime = sendTime
+
+    def getLatency(self):
+        "get the seconds from sending the probe to the first reply, or None if there was no reply"
+        if self.firstReplyTime is None:
+            return None
+        return max(self.firstReplyTime - self.sendTime, 0)
+
+
+def iterTargets(targets, limit=None):
+    """iterate over the hosts of a host, an IP network in CIDR notation, or a
+    list of these, without listing the hosts of networks up front; the network
+    & broadcast addresses of networks are left out. Raises ValueError before
+    giving any host if the targets span more than LIMIT addresses."""
+    if isinstance(targets, str):
+        targets = [targets]
+
+    parsed = []
+    count = 0
+    for target in targets:
+        try:
+            network = ipaddress.ip_network(target, strict=False)
+        except ValueError:  # a host name
+            parsed.append(target)
+            count += 1
+            continue
+        parsed.append(network)
+        count += network.num_addresses
+    if limit is not None and count > limit:
+        raise ValueError("targets span %i addresses, more than the limit of %i" % (count, limit))
+
+    for target in parsed:
+        if isinstance(target, str):
+            yield target
+        elif target.num_addresses == 1:
+            yield str(target.network_address)
+        else:
+            for host in target.hosts():
+                yield str(host)
+
+
+def expandTargets(targets):
+    """expand a host, an IP network in CIDR notation, or a list of these into
+    a list of hosts; the network & broadcast addresses of networks are left out"""
+    return list(iterTargets(targets))
@@ -14,6 +14,8 @@ class Service:
         self._instanceId = instanceId
         self._messageNumber = 0
         self._metadataVersion = 1
+        self._networkAddrs = None   # addresses to expand {ip} with; None means all local addresses
+        self._expandedXAddrs = None
 
     def getTypes(self):
         "get service types"
@@ -33,15 +35,23 @@ class Service:
 
     def getXAddrs(self):
         "get service network address"
+        if self._expandedXAddrs is None:
+            self._expandedXAddrs = self._expandXAddrs()
+        return list(self._expandedXAddrs)
+
+    def _expandXAddrs(self):
         ret = []
-        ipAddrs = None
+        ipAddrs = self._networkAddrs
         for xAddr in self._xAddrs:
             if '{ip}' in xAddr:
                 if ipAddrs is None:
                     ipAddrs = _getNetworkAddrs()
                 for ipAddr in ipAddrs:
-                    if ipAddr != '127.0.0.1':
-                        ret.append(xAddr.format(ip=ipAddr))
+                    if ipAddr == '127.0.0.1' or '%' in ipAddr:
+                        continue  # the zone of a link-local address means nothing to other hosts
+                    if ':' in ipAddr:
+                        ipAddr = '[%s]' % ipAddr
+                    ret.append(xAddr.format(ip=ipAddr))
             else:
                 ret.append(xAddr)
         return ret
@@ -49,6 +59,13 @@ class Service:
     def setXAddrs(self, xAddrs):
         "set service network address"
         self._xAddrs = xAddrs
+        self._expandedXAddrs = None
+
+    def setNetworkAddrs(self, addrs):
+        """set the local addresses that {ip} in service network addresses
+        expands to; the expanded addresses are kept until this is called again"""
+        self._networkAddrs = list(addrs)
+        self._expandedXAddrs = None
 
     def getEPR(self):
         "get endpoint reference"
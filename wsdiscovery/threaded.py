@@ -2,28 +2,39 @@
 
 import logging
 import random
-import time
 import uuid
 import socket
-import struct
 import threading
 import selectors
+import select
+import queue
+import collections
 
-from .udp import UDPMessage
-from .actions import *
+from .udp import UDPMessage, UDPMessageScheduler
 from .uri import URI
-from .util import _getNetworkAddrs
-from .message import createSOAPMessage, parseSOAPMessage
+from .util import _getNetworkAddrs, _getNetworkAddrs6, _getInterfaceIndex
 from .service import Service
+from .addrwatch import createAddressWatcher
+from .batchio import createBatchIO
+from .transport import DatagramHandler, BUFFER_SIZE, MULTICAST_PORT, MULTICAST_IPV4_ADDRESS, \
+                       MULTICAST_IPV6_ADDRESS, isIPv6Addr, makeMreq, makeMreq6, makeSockaddr6, \
+                       createMulticastOutSocket, createMulticastInSocket, \
+                       createMulticastOutSocket6, createMulticastInSocket6, \
+                       supportsPktinfo, makePktinfo, parsePktinfo, enablePktinfo, PKTINFO_BUFFER_SIZE
 
 
 logger = logging.getLogger("threading")
 
 
-BUFFER_SIZE = 0xffff
 NETWORK_ADDRESSES_CHECK_TIMEOUT = 5
-MULTICAST_PORT = 3702
-MULTICAST_IPV4_ADDRESS = "239.255.255.250"
+
+# upper limit for reading from one socket in one go, so that a flood of
+# datagrams does not hold up sending; the rest are read on the next round
+MAX_DATAGRAMS_PER_WAKEUP = 256
+
+# received datagrams waiting for a worker; more are dropped, like the
+# socket would drop them when its buffer is full
+WORKER_QUEUE_SIZE = 1024
 
 
 class _StoppableDaemonThread(threading.Thread):
@@ -43,17 +54,24 @@ class _StoppableDaemonThread(threading.Thread):
         self._quitEvent.set()
 
 
-class AddressMonitorThread(_StoppableDaemonThread):
-    "trigger address change callbacks when local service addresses change"
+class AddressMonitor:
+    """trigger address change callbacks when local service addresses change
+
+    The addresses are checked when the address WATCHER reports that they
+    may have changed; by default, the best watcher for the platform is used.
+    With IPV6, IPv6 addresses are monitored along with the IPv4 addresses.
+    """
 
-    def __init__(self, wsd):
+    def __init__(self, wsd, watcher=None, ipv6=False):
         self._addrs = set()
         self._wsd = wsd
-        super(AddressMonitorThread, self).__init__()
-        self._updateAddrs()
+        self._watcher = watcher if watcher is not None else createAddressWatcher()
+        self._ipv6 = ipv6
 
     def _updateAddrs(self):
         addrs = set(_getNetworkAddrs())
+        if self._ipv6:
+            addrs.update(_getNetworkAddrs6())
 
         disappeared = self._addrs.difference(addrs)
         new = addrs.difference(self._addrs)
@@ -66,194 +84,464 @@ class AddressMonitorThread(_StoppableDaemonThread):
 
         self._addrs = addrs
 
+
+class AddressMonitorThread(_StoppableDaemonThread, AddressMonitor):
+    "watch local service addresses for changes in a thread"
+
+    def __init__(self, wsd, watcher=None, ipv6=False):
+        AddressMonitor.__init__(self, wsd, watcher, ipv6)
+        super(AddressMonitorThread, self).__init__()
+        # only needed when waiting for notifications, which is Linux-only
+        self._wakeupSockets = socket.socketpair() if self._watcher.fileno() is not None else None
+        self._updateAddrs()
+
+    def schedule_stop(self):
+        super(AddressMonitorThread, self).schedule_stop()
+        if self._wakeupSockets is not None:
+            self._wakeupSockets[1].send(b"\0")
+
     def run(self):
-        while not self._quitEvent.wait(NETWORK_ADDRESSES_CHECK_TIMEOUT):
-            self._updateAddrs()
+        if self._wakeupSockets is None:
+            while not self._quitEvent.wait(NETWORK_ADDRESSES_CHECK_TIMEOUT):
+                self._updateAddrs()
+            return
 
+        while not self._quitEvent.is_set():
+            readable, _, _ = select.select([self._watcher, self._wakeupSockets[0]], [], [])
+            if self._watcher in readable and self._watcher.read():
+                self._updateAddrs()
 
-class NetworkingThread(_StoppableDaemonThread):
-    def __init__(self, observer, capture=None):
-        super(NetworkingThread, self).__init__()
+    def join(self):
+        super(AddressMonitorThread, self).join()
+        self._watcher.close()
+        if self._wakeupSockets is not None:
+            for sock in self._wakeupSockets:
+                sock.close()
 
-        self.setDaemon(True)
-        self._queue = []    # FIXME synchronisation
 
-        self._knownMessageIds = set()
-        self._iidMap = {}
-        self._observer = observer
-        self._capture = observer._capture
-        self._seqnum = 1 # capture sequence number
-        self._selector = selectors.DefaultSelector()
+class DatagramWorkerPool:
+    """Parse & dispatch received datagrams in worker threads, so that slow
+    message handlers and callbacks do not hold up the networking thread.
 
-    @staticmethod
-    def _makeMreq(addr):
-        return struct.pack("4s4s", socket.inet_aton(MULTICAST_IPV4_ADDRESS), socket.inet_aton(addr))
-
-    @staticmethod
-    def _createMulticastOutSocket(addr, ttl):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setblocking(0)
-        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
-        if addr is None:
-            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.INADDR_ANY)
-        else:
-            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(addr))
+    Datagrams are parsed concurrently, but passed on to the observer one
+    at a time, since the WS-Discovery daemons are not thread-safe. With more
+    than one worker, messages may be dispatched in a different order than
+    they were received.
+    """
 
-        return sock
+    def __init__(self, handler, workers, queueSize=WORKER_QUEUE_SIZE):
+        self._handler = handler
+        self._queue = queue.Queue(queueSize)
+        self._dispatchLock = threading.Lock()
+        self._closed = False
+        self._threads = [threading.Thread(target=self._work, daemon=True) for i in range(workers)]
 
-    @staticmethod
-    def _createMulticastInSocket():
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.submitted = 0
+        self.dropped = 0
+        self.highWater = 0
 
-        sock.bind(('', MULTICAST_PORT))
-        sock.setblocking(0)
+    def start(self):
+        for thread in self._threads:
+            thread.start()
 
-        return sock
+    def submit(self, data, addr):
+        "queue a received datagram for handling; drops it if the queue is full"
+        if self._closed:
+            return
+        try:
+            self._queue.put_nowait((data, addr))
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.submitted += 1
+        self.highWater = max(self.highWater, self._queue.qsize())
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            data, addr = item
+            try:
+                env = self._handler._parseDatagram(data, addr)
+                if env is not None:
+                    with self._dispatchLock:
+                        self._handler._observer.envReceived(env, addr)
+            except Exception:
+                logger.exception("failed to handle message from %s", addr[0])
+
+    def stop(self):
+        "handle the datagrams already queued, then stop the workers"
+        self._closed = True
+        for thread in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def getStats(self):
+        "get the queue counters: submitted & dropped datagrams, current & highest queue length"
+        return {"workers": len(self._threads), "submitted": self.submitted, "dropped": self.dropped,
+                "queued": self._queue.qsize(), "highWater": self.highWater}
+
+
+class NetworkingThread(_StoppableDaemonThread, DatagramHandler):
+    """Send & receive messages in a thread.
+
+    The thread blocks on the socket selector until a socket is readable or
+    the next queued message is due. Queueing a message or scheduling a stop
+    wakes the thread up through a loopback wakeup socket.
+
+    With WORKERS, received datagrams are handed over to a pool of that many
+    worker threads; otherwise they are handled in the networking thread.
+
+    Multicast is sent from every local address. By default, each address
+    has a socket of its own; with SHARED_SOCKET, a single socket is used
+    and the source address & interface are picked per datagram with
+    IP_PKTINFO, which also tells on which interface datagrams arrive.
+    Platforms without IP_PKTINFO fall back to a socket per address.
+
+    With BATCH_IO, the datagrams due at once are sent in one batch per
+    socket, and waiting datagrams are received in batches, with as few
+    system calls as the platform allows.
+
+    With IPV6, messages are also sent & received over IPv6. Multicast goes
+    to the IPv6 group on every interface that has a local IPv6 address,
+    through one socket; the interface is picked by the scope of the group
+    address.
+    """
+
+    def __init__(self, observer, capture=None, workers=0, sharedSocket=False, batchIO=False,
+                 ipv6=False):
+        super(NetworkingThread, self).__init__()
+        DatagramHandler.__init__(self, observer)
+
+        self._workerPool = DatagramWorkerPool(self, workers) if workers else None
+
+        if sharedSocket and not supportsPktinfo():
+            logger.warning("IP_PKTINFO is not supported, using a multicast socket per address")
+            sharedSocket = False
+        self._sharedSocket = sharedSocket
+        self._pktinfoSockets = set()          # sockets read with recvmsg() for the ingress interface
+        self._ingress = collections.Counter() # local address -> datagrams received on its interface
+        self._batchIO = createBatchIO() if batchIO else None
+        self._ipv6 = ipv6
+
+        self.setDaemon(True)
+        self._queue = UDPMessageScheduler()
+
+        self._selector = selectors.DefaultSelector()
+        self._recvBuffer = bytearray(BUFFER_SIZE)
+        self._recvView = memoryview(self._recvBuffer)
+
+        # a loopback socket sending to itself is portable to all platforms
+        # that selectors support, unlike pipes
+        self._wakeupSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._wakeupSocket.bind(("127.0.0.1", 0))
+        self._wakeupSocket.setblocking(0)
+
+    def _getOwnAddrs(self):
+        monitor = self._observer._addrsMonitorThread
+        return monitor._addrs if monitor is not None else set()
+
+    def getStats(self):
+        stats = super(NetworkingThread, self).getStats()
+        if self._workerPool is not None:
+            stats["workerPool"] = self._workerPool.getStats()
+        if self._sharedSocket:
+            stats["ingress"] = dict(self._ingress)
+        if self._batchIO is not None:
+            stats["batchIO"] = self._batchIO.getStats()
+        return stats
 
     def addSourceAddr(self, addr):
         """None means 'system default'"""
+        if addr is not None and isIPv6Addr(addr):
+            self._addSourceAddr6(addr)
+            return
+
         try:
-            self._multiInSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, self._makeMreq(addr))
+            self._multiInSocket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, makeMreq(addr))
         except socket.error:  # if 1 interface has more than 1 address, exception is raised for the second
             pass
 
-        sock = self._createMulticastOutSocket(addr, self._observer.ttl)
+        if self._sharedSocket:
+            self._sourcePktinfos[addr] = makePktinfo(addr)
+            return
+
+        sock = createMulticastOutSocket(addr, self._observer.ttl)
         self._multiOutUniInSockets[addr] = sock
         self._selector.register(sock, selectors.EVENT_READ)
 
     def removeSourceAddr(self, addr):
+        if addr is not None and isIPv6Addr(addr):
+            self._removeSourceAddr6(addr)
+            return
+
         try:
-            self._multiInSocket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, self._makeMreq(addr))
+            self._multiInSocket.setsockopt(socket.IPPROTO_IP, socket.IP_DROP_MEMBERSHIP, makeMreq(addr))
         except socket.error:  # see comments for setsockopt(.., socket.IP_ADD_MEMBERSHIP..
             pass
 
+        if self._sharedSocket:
+            del self._sourcePktinfos[addr]
+            return
+
         sock = self._multiOutUniInSockets[addr]
         self._selector.unregister(sock)
         sock.close()
         del self._multiOutUniInSockets[addr]
 
+    def _addSourceAddr6(self, addr):
+        "join the IPv6 group on the interface of the address, unless one of its other addresses did"
+        ifindex = _getInterfaceIndex(addr)
+        if ifindex is None:  # gone again already
+            return
+        self._sourceInterfaces6[addr] = ifindex
+        self._interfaces6[ifindex] += 1
+        if self._interfaces6[ifindex] == 1:
+            try:
+                self._multiInSocket6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_JOIN_GROUP,
+                                                makeMreq6(ifindex))
+            except socket.error as ex:
+                logger.debug("cannot join the IPv6 group on interface %s: %s", ifindex, ex)
+
+    def _removeSourceAddr6(self, addr):
+        "leave the IPv6 group on the interface of the address, when it was its last address"
+        ifindex = self._sourceInterfaces6.pop(addr, None)
+        if ifindex is None:
+            return
+        self._interfaces6[ifindex] -= 1
+        if self._interfaces6[ifindex] == 0:
+            del self._interfaces6[ifindex]
+            try:
+                self._multiInSocket6.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_LEAVE_GROUP,
+                                                makeMreq6(ifindex))
+            except socket.error:  # the interface is gone
+                pass
+
     def addUnicastMessage(self, env, addr, port, initialDelay=0):
         msg = UDPMessage(env, addr, port, UDPMessage.UNICAST, initialDelay)
 
-        self._queue.append(msg)
-        self._knownMessageIds.add(env.getMessageId())
+        self._queue.add(msg)
+        self._registerMessage(env)
+        self._wakeup()
 
     def addMulticastMessage(self, env, addr, port, initialDelay=0):
         msg = UDPMessage(env, addr, port, UDPMessage.MULTICAST, initialDelay)
 
-        self._queue.append(msg)
-        self._knownMessageIds.add(env.getMessageId())
+        self._queue.add(msg)
+        self._registerMessage(env)
+        self._wakeup()
+
+    def _wakeup(self):
+        "make the thread re-check its queue & quit event"
+        try:
+            self._wakeupSocket.sendto(b"\0", self._wakeupSocket.getsockname())
+        except socket.error:  # buffer full - a wakeup is pending anyway
+            pass
+
+    def schedule_stop(self):
+        if self._workerPool is not None:
+            self._workerPool.stop()
+        super(NetworkingThread, self).schedule_stop()
+        self._wakeup()
 
     def run(self):
         while not self._quitEvent.is_set() or self._queue:
             self._sendPendingMessages()
-            self._recvMessages()
-
-    def _recvMessages(self):
-        for key, events in self._selector.select(0):
-            sock = socket.fromfd(key.fd, socket.AF_INET, socket.SOCK_DGRAM)
-            try:
-                data, addr = sock.recvfrom(BUFFER_SIZE)
-            except socket.error as e:
-                time.sleep(0.01)
-                continue
-
-            env = parseSOAPMessage(data, addr[0])
-
-            if env is None: # fault or failed to parse
+            self._recvMessages(self._queue.getDelay())
+
+    def _recvMessages(self, timeout=None):
+        """wait for incoming messages and handle them; TIMEOUT is in
+        milliseconds, None means waiting until woken up"""
+        if timeout is not None:
+            timeout = timeout / 1000
+        for key, events in self._selector.select(timeout):
+            if key.fileobj is self._wakeupSocket:
+                self._drainWakeups()
                 continue
 
-            _own_addrs = self._observer._addrsMonitorThread._addrs
-            if addr[0] not in _own_addrs:
-                if env.getAction() == NS_ACTION_PROBE_MATCH:
-                    prms = "\n ".join((str(prm) for prm in env.getProbeResolveMatches()))
-                    msg = "probe response from %s:\n --- begin ---\n%s\n--- end ---\n"
-                    logger.debug(msg, addr[0], prms)
-
-                if self._capture:
-                    self._capture.write("%i RECV %s:%s\n" % (self._seqnum, addr[0], addr[1]))
-                    self._capture.write(data.decode("utf-8") + "\n")
-                    self._seqnum += 1
+            self._recvFrom(key.fileobj)
+
+    def _recvFrom(self, sock):
+        """handle the datagrams waiting in the socket, until there are no
+        more or MAX_DATAGRAMS_PER_WAKEUP have been read"""
+        pktinfo = sock in self._pktinfoSockets
+        if self._batchIO is not None:
+            ancBufSize = PKTINFO_BUFFER_SIZE if pktinfo else 0
+            for data, addr, ancdata in self._batchIO.recvBatch(sock, MAX_DATAGRAMS_PER_WAKEUP, ancBufSize):
+                if pktinfo:
+                    self._ingress[parsePktinfo(ancdata)] += 1
+                self._dispatchDatagram(data, addr)
+            return
 
-            mid = env.getMessageId()
-            if mid in self._knownMessageIds:
-                continue
-            else:
-                self._knownMessageIds.add(mid)
-
-            iid = env.getInstanceId()
-            if len(iid) > 0 and int(iid) >= 0:
-                mnum = env.getMessageNumber()
-                key = addr[0] + ":" + str(addr[1]) + ":" + str(iid)
-                if mid is not None and len(mid) > 0:
-                    key = key + ":" + mid
-                if key not in self._iidMap:
-                    self._iidMap[key] = iid
+        for i in range(MAX_DATAGRAMS_PER_WAKEUP):
+            try:
+                if pktinfo:
+                    nbytes, ancdata, flags, addr = sock.recvmsg_into([self._recvBuffer], PKTINFO_BUFFER_SIZE)
+                    self._ingress[parsePktinfo(ancdata)] += 1
                 else:
-                    tmnum = self._iidMap[key]
-                    if mnum > tmnum:
-                        self._iidMap[key] = mnum
-                    else:
-                        continue
+                    nbytes, addr = sock.recvfrom_into(self._recvBuffer)
+            except socket.error:  # nothing more to read (or an ICMP error)
+                return
+
+            self._dispatchDatagram(bytes(self._recvView[:nbytes]), addr)
+
+    def _dispatchDatagram(self, data, addr):
+        "handle a received datagram, or hand it over to the worker pool"
+        if len(addr) > 3 and "%" in addr[0]:  # Python < 3.7 also puts the zone in the host
+            addr = (addr[0].partition("%")[0],) + addr[1:]
+        if self._workerPool is not None:
+            self._captureDatagram(data, addr)
+            self._workerPool.submit(data, addr)
+        else:
+            self._handleDatagram(data, addr)
 
-            self._observer.envReceived(env, addr)
+    def _drainWakeups(self):
+        while True:
+            try:
+                self._wakeupSocket.recv(BUFFER_SIZE)
+            except socket.error:
+                return
+
+    def _getOutSockets(self, msg):
+        """get the sockets to send a message through, each with the address to
+        send it to and the IP_PKTINFO data to send it with"""
+        addr = (msg.getAddr(), msg.getPort())
+        if msg.msgType() == UDPMessage.UNICAST:
+            if self._ipv6 and isIPv6Addr(addr[0]):
+                return [(self._uniOutSocket6, makeSockaddr6(addr[0], addr[1]), None)]
+            return [(self._uniOutSocket, addr, None)]
+
+        if self._sharedSocket:
+            out = [(self._multiOutSocket, addr, pktinfo) for pktinfo in list(self._sourcePktinfos.values())]
+        else:
+            out = [(sock, addr, None) for sock in list(self._multiOutUniInSockets.values())]
+        if self._ipv6:
+            out.extend((self._multiOutSocket6, (MULTICAST_IPV6_ADDRESS, addr[1], 0, ifindex), None)
+                       for ifindex in list(self._interfaces6))
+        return out
 
     def _sendMsg(self, msg):
-        data = createSOAPMessage(msg.getEnv()).encode("UTF-8")
+        data = msg.getData()
+        for sock, addr, pktinfo in self._getOutSockets(msg):
+            self._sendTo(sock, data, addr, pktinfo)
 
-        if msg.msgType() == UDPMessage.UNICAST:
-            self._uniOutSocket.sendto(data, (msg.getAddr(), msg.getPort()))
-            if self._capture:
-                self._capture.write("%i SEND %s:%s\n" % (self._seqnum, msg.getAddr(), msg.getPort()))
-                self._capture.write(data.decode("utf-8") + "\n")
-                self._seqnum += 1
-        else:
-            for sock in list(self._multiOutUniInSockets.values()):
-                sock.sendto(data, (msg.getAddr(), msg.getPort()))
-                if self._capture:
-                    self._capture.write("%i SEND %s:%s\n" % (self._seqnum, msg.getAddr(), msg.getPort()))
-                    self._capture.write(data.decode("utf-8") + "\n")
-                    self._seqnum += 1
+    def _sendTo(self, sock, data, addr, pktinfo=None):
+        try:
+            if pktinfo is not None:
+                sock.sendmsg([data], pktinfo, 0, addr)
+            else:
+                sock.sendto(data, addr)
+        except socket.error as ex:  # e.g. no route to a unicast target; the message is repeated anyway
+            logger.debug("failed to send to %s:%s: %s", addr[0], addr[1], ex)
+            return
+        self._captureMessage("SEND", addr[0], addr[1], data)
+
+    def _sendBatched(self, msgs):
+        "send messages with one batch of datagrams per socket"
+        batches = {}  # socket -> datagrams
+        for msg in msgs:
+            data = msg.getData()
+            for sock, addr, pktinfo in self._getOutSockets(msg):
+                batches.setdefault(sock, []).append((data, addr, pktinfo))
+
+        for sock, datagrams in batches.items():
+            failed = dict(self._batchIO.sendBatch(sock, datagrams))
+            for i, (data, addr, pktinfo) in enumerate(datagrams):
+                if i in failed:  # the message is repeated anyway
+                    logger.debug("failed to send to %s:%s: %s", addr[0], addr[1], failed[i])
+                else:
+                    self._captureMessage("SEND", addr[0], addr[1], data)
 
     def _sendPendingMessages(self):
-        """Method sleeps, if nothing to do"""
-        if len(self._queue) == 0:
-            time.sleep(0.1)
-            return
-        msg = self._queue.pop(0)
-        if msg.canSend():
-            self._sendMsg(msg)
+        "send all messages that are due"
+        due = self._queue.popDue()
+        if self._batchIO is not None:
+            self._sendBatched(due)
+        for msg in due:
+            if self._batchIO is None:
+                self._sendMsg(msg)
             msg.refresh()
             if not (msg.isFinished()):
-                self._queue.append(msg)
-        else:
-            self._queue.append(msg)
-            time.sleep(0.01)
+                self._queue.add(msg)
 
     def start(self):
-        super(NetworkingThread, self).start()
-
+        # replies to unicast messages come back to the socket they were sent from
         self._uniOutSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-        self._multiInSocket = self._createMulticastInSocket()
-        self._selector.register(self._multiInSocket, selectors.EVENT_WRITE | selectors.EVENT_READ)
-
-        self._multiOutUniInSockets = {}  # FIXME synchronisation
+        self._uniOutSocket.setblocking(0)
+        self._selector.register(self._uniOutSocket, selectors.EVENT_READ)
+
+        self._multiInSocket = createMulticastInSocket()
+        self._selector.register(self._multiInSocket, selectors.EVENT_READ)
+        self._selector.register(self._wakeupSocket, selectors.EVENT_READ)
+
+        # local address -> socket; changed from the address monitor thread, so
+        # the networking thread only iterates over copies of the sockets
+        self._multiOutUniInSockets = {}
+
+        if self._sharedSocket:
+            self._sourcePktinfos = {}  # local address -> ancillary data for sending from it
+            self._multiOutSocket = createMulticastOutSocket(None, self._observer.ttl)
+            self._selector.register(self._multiOutSocket, selectors.EVENT_READ)
+            for sock in (self._multiInSocket, self._multiOutSocket):
+                enablePktinfo(sock)
+                self._pktinfoSockets.add(sock)
+
+        if self._ipv6:
+            self._uniOutSocket6 = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+            self._uniOutSocket6.setblocking(0)
+            self._multiInSocket6 = createMulticastInSocket6()
+            self._multiOutSocket6 = createMulticastOutSocket6(self._observer.ttl)
+            for sock in (self._uniOutSocket6, self._multiInSocket6, self._multiOutSocket6):
+                self._selector.register(sock, selectors.EVENT_READ)
+
+            self._interfaces6 = collections.Counter()  # interface index -> local IPv6 addresses on it
+            self._sourceInterfaces6 = {}               # local IPv6 address -> interface index
+
+        if self._workerPool is not None:
+            self._workerPool.start()
+        super(NetworkingThread, self).start()
 
     def join(self):
         super(NetworkingThread, self).join()
+        self._selector.unregister(self._uniOutSocket)
         self._uniOutSocket.close()
 
         self._selector.unregister(self._multiInSocket)
         self._multiInSocket.close()
 
+        self._selector.unregister(self._wakeupSocket)
+        self._wakeupSocket.close()
+
+        if self._sharedSocket:
+            self._selector.unregister(self._multiOutSocket)
+            self._multiOutSocket.close()
+
+        if self._ipv6:
+            for sock in (self._uniOutSocket6, self._multiInSocket6, self._multiOutSocket6):
+                self._selector.unregister(sock)
+                sock.close()
+
 
 class ThreadedNetworking:
-    "handle threaded networking start & stop, address add/remove & message sending"
+    """handle threaded networking start & stop, address add/remove & message sending
+
+    WORKERS is the number of threads for handling received messages; with
+    the default of 0, they are handled in the networking thread. With
+    SHARED_SOCKET, multicast is sent from all local addresses through one
+    socket instead of a socket per address. With BATCH_IO, datagrams are
+    sent & received in batches. With IPV6, the IPv6 multicast group is used
+    along with the IPv4 one, so that searches cover both.
+    """
 
-    def __init__(self, **kwargs):
+    def __init__(self, workers=0, sharedSocket=False, batchIO=False, ipv6=False, **kwargs):
+        self._workers = workers
+        self._sharedSocket = sharedSocket
+        self._batchIO = batchIO
+        self._ipv6 = ipv6
         self._networkingThread = None
+        self._addrsMonitorThread = None
         self._serverStarted = False
         super().__init__(**kwargs)
 
@@ -261,10 +549,12 @@ class ThreadedNetworking:
         if self._networkingThread is not None:
             return
 
-        self._networkingThread = NetworkingThread(self)
+        self._networkingThread = NetworkingThread(self, workers=self._workers,
+                                                 sharedSocket=self._sharedSocket,
+                                                 batchIO=self._batchIO, ipv6=self._ipv6)
         self._networkingThread.start()
         logger.debug("networking thread started")
-        self._addrsMonitorThread = AddressMonitorThread(self)
+        self._addrsMonitorThread = AddressMonitorThread(self, ipv6=self._ipv6)
         self._addrsMonitorThread.start()
         logger.debug("address monitoring thread started")
 
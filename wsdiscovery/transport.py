@@ -0,0 +1,224 @@
+"""SOAP-over-UDP socket & datagram handling shared by the networking implementations."""
+
+import logging
+import socket
+import struct
+import sys
+
+from .actions import *
+from .message import parseSOAPMessage
+from .cache import ExpiringCache
+from .appsequence import AppSequenceTracker
+from .udp import RETRANSMISSION_WINDOW
+
+
+logger = logging.getLogger("transport")
+
+
+BUFFER_SIZE = 0xffff
+MULTICAST_PORT = 3702
+MULTICAST_IPV4_ADDRESS = "239.255.255.250"
+MULTICAST_IPV6_ADDRESS = "FF02::C"  # link-local scope
+
+# Repeats of a message arrive within its retransmission window, which may
+# start up to a second later than the message was queued, so message IDs
+# are remembered for a few windows; the capacity covers sustained rates of
+# well over a thousand messages per second.
+MESSAGE_ID_CACHE_TTL = 4 * RETRANSMISSION_WINDOW / 1000 # seconds
+MESSAGE_ID_CACHE_SIZE = 16384
+# The IDs of sent messages are kept apart, so that a burst of sends such as a
+# sweep of directed probes does not evict the IDs of received messages.
+SENT_MESSAGE_ID_CACHE_SIZE = 4096
+
+# Only recent Python versions expose IP_PKTINFO; its value is fixed per platform.
+IP_PKTINFO = getattr(socket, "IP_PKTINFO", 8 if sys.platform.startswith("linux") else None)
+_IN_PKTINFO = struct.Struct("=i4s4s")  # interface index, local address, destination address
+PKTINFO_BUFFER_SIZE = socket.CMSG_SPACE(_IN_PKTINFO.size) if hasattr(socket, "CMSG_SPACE") else 0
+
+
+def makeMreq(addr):
+    "pack a multicast group membership request for the given local address"
+    return struct.pack("4s4s", socket.inet_aton(MULTICAST_IPV4_ADDRESS), socket.inet_aton(addr))
+
+
+def isIPv6Addr(addr):
+    "check whether an address is an IPv6 rather than an IPv4 address or host name"
+    return ":" in addr
+
+
+def makeSockaddr6(host, port):
+    """make an IPv6 socket address tuple for HOST & PORT; the zone of a
+    link-local address like ``fe80::1%eth0`` becomes the scope id, which
+    sendto() leaves unset for a bare (host, port) pair"""
+    host, _, zone = host.partition("%")
+    scope = 0
+    if zone:
+        try:
+            scope = int(zone) if zone.isdigit() else socket.if_nametoindex(zone)
+        except OSError:
+            pass
+    return (host, port, 0, scope)
+
+
+def getReplyHost(addr):
+    """get the host to reply to a datagram received from ADDR at; a link-local
+    IPv6 sender keeps the scope id of its address as the zone"""
+    if len(addr) > 3 and addr[3]:
+        return "%s%%%i" % (addr[0], addr[3])
+    return addr[0]
+
+
+def makeMreq6(ifindex):
+    "pack an IPv6 multicast group membership request for the given interface"
+    return socket.inet_pton(socket.AF_INET6, MULTICAST_IPV6_ADDRESS) + struct.pack("@I", ifindex)
+
+
+def createMulticastOutSocket(addr, ttl):
+    "create a non-blocking socket for sending multicast from the given local address"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setblocking(0)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    if addr is None:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.INADDR_ANY)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(addr))
+
+    return sock
+
+
+def createMulticastInSocket():
+    "create a non-blocking socket for receiving multicast on the WS-Discovery port"
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    sock.bind(('', MULTICAST_PORT))
+    sock.setblocking(0)
+
+    return sock
+
+
+def createMulticastOutSocket6(hops):
+    """create a non-blocking socket for sending IPv6 multicast; the interface
+    is picked per datagram by the scope of the destination address"""
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+    sock.setblocking(0)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_MULTICAST_HOPS, hops)
+
+    return sock
+
+
+def createMulticastInSocket6():
+    "create a non-blocking socket for receiving IPv6 multicast on the WS-Discovery port"
+    sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+
+    sock.bind(('::', MULTICAST_PORT))
+    sock.setblocking(0)
+
+    return sock
+
+
+def supportsPktinfo():
+    "check whether the egress & ingress interface of datagrams can be controlled per datagram"
+    return IP_PKTINFO is not None and hasattr(socket.socket, "sendmsg") and PKTINFO_BUFFER_SIZE > 0
+
+
+def makePktinfo(addr):
+    """make the ancillary data for sending a datagram with sendmsg() from the
+    given local address, and the interface it belongs to; None means 'system default'"""
+    local = socket.inet_aton(addr) if addr is not None else bytes(4)
+    return [(socket.IPPROTO_IP, IP_PKTINFO, _IN_PKTINFO.pack(0, local, bytes(4)))]
+
+
+def parsePktinfo(ancdata):
+    """get the local address of the interface a datagram was received on from
+    the ancillary data given by recvmsg(), or None if it is not there"""
+    for level, kind, data in ancdata:
+        if level == socket.IPPROTO_IP and kind == IP_PKTINFO and len(data) >= _IN_PKTINFO.size:
+            return socket.inet_ntoa(_IN_PKTINFO.unpack_from(data)[1])
+    return None
+
+
+def enablePktinfo(sock):
+    "make recvmsg() on the socket tell the interface each datagram was received on"
+    sock.setsockopt(socket.IPPROTO_IP, IP_PKTINFO, 1)
+
+
+class DatagramHandler:
+    """Bookkeeping for sent & received messages, independent of how the
+    datagrams are actually sent and received.
+
+    Filters out duplicate messages and Hello & Bye messages that are older
+    than ones already received, and passes the rest on to the observer (the
+    WS-Discovery daemon).
+    """
+
+    def __init__(self, observer):
+        self._knownMessageIds = ExpiringCache(MESSAGE_ID_CACHE_SIZE, MESSAGE_ID_CACHE_TTL)
+        self._sentMessageIds = ExpiringCache(SENT_MESSAGE_ID_CACHE_SIZE, MESSAGE_ID_CACHE_TTL)
+        self._appSequences = AppSequenceTracker()
+        self._observer = observer
+        self._capture = observer._capture
+        self._seqnum = 1 # capture sequence number
+
+    def _getOwnAddrs(self):
+        "return the set of local network addresses"
+        return set()
+
+    def getStats(self):
+        "get the duplicate detection cache counters"
+        return {"knownMessageIds": self._knownMessageIds.getStats(),
+                "sentMessageIds": self._sentMessageIds.getStats(),
+                "appSequences": self._appSequences.getStats()}
+
+    def _registerMessage(self, env):
+        "remember an outgoing message so that its echoes are ignored"
+        self._sentMessageIds.set(env.getMessageId())
+
+    def _captureMessage(self, direction, addr, port, data):
+        if self._capture:
+            self._capture.write("%i %s %s:%s\n" % (self._seqnum, direction, addr, port))
+            self._capture.write(data.decode("utf-8", errors="replace") + "\n")
+            self._seqnum += 1
+
+    def _filterHeader(self, env, addr):
+        """decide from its headers whether a message received from ADDR is worth
+        parsing in full: repeats, echoes of sent messages & stale announcements
+        are not"""
+        mid = env.getMessageId()
+        if mid and (mid in self._sentMessageIds or not self._knownMessageIds.add(mid)):
+            return False
+
+        if env.getAction() in (NS_ACTION_HELLO, NS_ACTION_BYE):
+            return self._appSequences.accept(addr, env.getInstanceId(),
+                                             env.getSequenceId(), env.getMessageNumber())
+        return True
+
+    def _captureDatagram(self, data, addr):
+        "write a received datagram to the capture file, unless it is from a local address"
+        if addr[0] not in self._getOwnAddrs():
+            self._captureMessage("RECV", addr[0], addr[1], data)
+
+    def _parseDatagram(self, data, addr):
+        """parse a received datagram; gives None for messages that are to be
+        ignored. May be called from several threads at once."""
+        env = parseSOAPMessage(data, addr[0], lambda env: self._filterHeader(env, addr))
+
+        if env is None: # fault, failed to parse, duplicate or stale
+            return None
+
+        if env.getAction() == NS_ACTION_PROBE_MATCH and addr[0] not in self._getOwnAddrs():
+            prms = "\n ".join((str(prm) for prm in env.getProbeResolveMatches()))
+            msg = "probe response from %s:\n --- begin ---\n%s\n--- end ---\n"
+            logger.debug(msg, addr[0], prms)
+
+        return env
+
+    def _handleDatagram(self, data, addr):
+        "parse a received datagram and pass it on to the observer, unless it is to be ignored"
+        self._captureDatagram(data, addr)
+
+        env = self._parseDatagram(data, addr)
+        if env is not None:
+            self._observer.envReceived(env, addr)
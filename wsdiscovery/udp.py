@@ -7,9 +7,14 @@ is to be used; see
 http://docs.oasis-open.org/ws-dd/soapoverudp/1.1/os/wsdd-soapoverudp-1.1-spec-os.html#_Toc229451838
 """
 
+import heapq
+import itertools
 import random
+import threading
 import time
 
+from .message import createSOAPMessage
+
 # delays are in milliseconds
 
 UNICAST_UDP_REPEAT=2
@@ -22,6 +27,10 @@ MULTICAST_UDP_MIN_DELAY=50
 MULTICAST_UDP_MAX_DELAY=250
 MULTICAST_UDP_UPPER_DELAY=500
 
+#: upper limit for the time between the first & last repeat of a message
+RETRANSMISSION_WINDOW = max(UNICAST_UDP_REPEAT * UNICAST_UDP_UPPER_DELAY,
+                            MULTICAST_UDP_REPEAT * MULTICAST_UDP_UPPER_DELAY)
+
 
 class UDPMessage:
     "UDP message management implementation"
@@ -35,6 +44,7 @@ class UDPMessage:
         self._addr = addr
         self._port = port
         self._msgType = msgType
+        self._data = None
 
         if msgType == self.UNICAST:
             udpRepeat, udpMinDelay, udpMaxDelay, udpUpperDelay = \
@@ -57,6 +67,16 @@ class UDPMessage:
     def getEnv(self):
         return self._env
 
+    def getData(self):
+        "get the serialized message; it is serialized once and reused for every repeat"
+        if self._data is None:
+            self._data = createSOAPMessage(self._env).encode("UTF-8")
+        return self._data
+
+    def invalidate(self):
+        "discard the serialized message, e.g. after the envelope has been changed"
+        self._data = None
+
     def getAddr(self):
         return self._addr
 
@@ -69,9 +89,13 @@ class UDPMessage:
     def isFinished(self):
         return self._udpRepeat <= 0
 
+    def getDelay(self):
+        "milliseconds until the message is due to be sent"
+        return max(0, self._nextTime - int(time.time() * 1000))
+
     def canSend(self):
         ct = int(time.time() * 1000)
-        return self._nextTime < ct
+        return self._nextTime <= ct
 
     def refresh(self):
         self._t = self._t * 2
@@ -81,3 +105,35 @@ class UDPMessage:
         self._udpRepeat = self._udpRepeat - 1
 
 
+class UDPMessageScheduler:
+    """Thread-safe queue of messages waiting to be (re)sent, ordered by
+    the time each message is next due to be sent."""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()  # keeps insertion order among equal deadlines
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def add(self, msg):
+        "queue a message to be sent when it is due"
+        with self._lock:
+            heapq.heappush(self._heap, (msg._nextTime, next(self._counter), msg))
+
+    def getDelay(self):
+        "milliseconds until the next message is due, or None if there are no messages"
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(0, self._heap[0][0] - int(time.time() * 1000))
+
+    def popDue(self):
+        "remove and return all messages that are due, earliest first"
+        ct = int(time.time() * 1000)
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= ct:
+                due.append(heapq.heappop(self._heap)[2])
+        return due
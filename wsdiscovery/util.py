@@ -1,122 +1,105 @@
 """Various utilities used by different parts of the package."""
 
-import io
-import string
+import functools
 import random
+import socket
 import netifaces
-from xml.dom import minidom
-from .scope import Scope
+from xml.sax.saxutils import escape, quoteattr
 from .uri import URI
 from .namespaces import NS_ADDRESSING, NS_DISCOVERY, NS_SOAPENV
-from .qname import QName
 
 
-def createSkelSoapMessage(soapAction):
-    doc = minidom.Document()
-
-    envEl = doc.createElementNS(NS_SOAPENV, "s:Envelope")
-
-    envEl.setAttribute("xmlns:a", NS_ADDRESSING)  # minidom does not insert this automatically
-    envEl.setAttribute("xmlns:d", NS_DISCOVERY)
-    envEl.setAttribute("xmlns:s", NS_SOAPENV)
-
-    doc.appendChild(envEl)
-
-    headerEl = doc.createElementNS(NS_SOAPENV, "s:Header")
-    envEl.appendChild(headerEl)
-
-    addElementWithText(doc, headerEl, "a:Action", NS_ADDRESSING, soapAction)
-
-    bodyEl = doc.createElementNS(NS_SOAPENV, "s:Body")
-    envEl.appendChild(bodyEl)
-
-    return doc
-
-
-def addElementWithText(doc, parent, name, ns, value):
-    el = doc.createElementNS(ns, name)
-    text = doc.createTextNode(value)
-    el.appendChild(text)
-    parent.appendChild(el)
-
-
-def addEPR(doc, node, epr):
-    eprEl = doc.createElementNS(NS_ADDRESSING, "a:EndpointReference")
-    addElementWithText(doc, eprEl, "a:Address", NS_ADDRESSING, epr)
-    node.appendChild(eprEl)
-
-
-def addScopes(doc, node, scopes):
-    if scopes is not None and len(scopes) > 0:
-        addElementWithText(doc, node, "d:Scopes", NS_DISCOVERY, " ".join([x.getQuotedValue() for x in scopes]))
-        if scopes[0].getMatchBy() is not None and len(scopes[0].getMatchBy()) > 0:
-            node.getElementsByTagNameNS(NS_DISCOVERY, "Scopes")[0].setAttribute("MatchBy", scopes[0].getMatchBy())
-
-
-def addTypes(doc, node, types):
-    if types is not None and len(types) > 0:
-        envEl = getEnvEl(doc)
-        typeList = []
-        prefixMap = {}
-        for type in types:
-            ns = type.getNamespace()
-            localname = type.getLocalname()
-            if type.getNamespacePrefix() is None:
-                if prefixMap.get(ns) == None:
-                    prefix = getRandomStr()
-                    prefixMap[ns] = prefix
-                else:
-                    prefix = prefixMap.get(ns)
-            else:
-                prefix = type.getNamespacePrefix()
-            addNSAttrToEl(envEl, ns, prefix)
-            typeList.append(prefix + ":" + localname)
-        addElementWithText(doc, node, "d:Types", NS_DISCOVERY, " ".join(typeList))
-
-
-def addXAddrs(doc, node, xAddrs):
-    if xAddrs is not len(xAddrs) > 0:
-        addElementWithText(doc, node, "d:XAddrs", NS_DISCOVERY, " ".join([x for x in xAddrs]))
-
-
-def getDocAsString(doc):
-    outStr = None
-    stream = io.StringIO(outStr)
-    stream.write(doc.toprettyxml())
-    return stream.getvalue()
-
-
-def getBodyEl(doc):
-    return doc.getElementsByTagNameNS(NS_SOAPENV, "Body")[0]
-
-
-def getHeaderEl(doc):
-    return doc.getElementsByTagNameNS(NS_SOAPENV, "Header")[0]
-
-
-def getEnvEl(doc):
-    return doc.getElementsByTagNameNS(NS_SOAPENV, "Envelope")[0]
-
-
-def addNSAttrToEl(el, ns, prefix):
-    el.setAttribute("xmlns:" + prefix, ns)
-
-
-def _parseAppSequence(dom, env):
-    nodes = dom.getElementsByTagNameNS(NS_DISCOVERY, "AppSequence")
-    if nodes:
-        appSeqNode = nodes[0]
-        env.setInstanceId(appSeqNode.getAttribute("InstanceId"))
-        env.setSequenceId(appSeqNode.getAttribute("SequenceId"))
-        env.setMessageNumber(appSeqNode.getAttribute("MessageNumber"))
-
-
-def _parseSpaceSeparatedList(node):
-    if node.childNodes:
-        return [item.replace('%20', ' ') \
-            for item in node.childNodes[0].data.split()]
-    else:
-        return []
+class SoapMessageWriter:
+    """Compact SOAP message serializer that writes escaped XML text directly,
+    without building a document and without pretty-printing whitespace.
+
+    Header elements may be added at any time; body elements are written in
+    document order.
+    """
+
+    def __init__(self, soapAction):
+        self._namespaces = [("a", NS_ADDRESSING), ("d", NS_DISCOVERY), ("s", NS_SOAPENV)]
+        self._prefixes = {prefix: ns for prefix, ns in self._namespaces}
+        self._typePrefixes = {}  # namespace -> generated prefix
+        self._header = []
+        self._body = []
+        self.addHeaderText("a:Action", soapAction)
+
+    @staticmethod
+    def _element(name, value, attrs):
+        attrStr = "".join(" %s=%s" % (k, quoteattr(v)) for k, v in attrs)
+        return "<%s%s>%s</%s>" % (name, attrStr, escape(value), name)
+
+    def _declareNamespace(self, prefix, ns):
+        if prefix not in self._prefixes:
+            self._prefixes[prefix] = ns
+            self._namespaces.append((prefix, ns))
+
+    def addHeaderText(self, name, value, attrs=()):
+        "add a header element with a text value & optional (name, value) attributes"
+        self._header.append(self._element(name, value, attrs))
+
+    def addAppSequence(self, env):
+        attrs = [("InstanceId", env.getInstanceId())]
+        if env.getSequenceId():
+            attrs.append(("SequenceId", env.getSequenceId()))
+        attrs.append(("MessageNumber", env.getMessageNumber()))
+        self._header.append("<d:AppSequence%s/>" % "".join(" %s=%s" % (k, quoteattr(v)) for k, v in attrs))
+
+    def startElement(self, name):
+        self._body.append("<%s>" % name)
+
+    def endElement(self, name):
+        self._body.append("</%s>" % name)
+
+    def addText(self, name, value, attrs=()):
+        "add a body element with a text value & optional (name, value) attributes"
+        self._body.append(self._element(name, value, attrs))
+
+    def addEPR(self, epr):
+        self._body.append("<a:EndpointReference>%s</a:EndpointReference>" %
+                          self._element("a:Address", epr, ()))
+
+    def _getTypePrefix(self, type):
+        """get the prefix to write a type with: its own, unless it has none or
+        it is taken by another namespace, in which case one is generated"""
+        ns = type.getNamespace()
+        prefix = type.getNamespacePrefix()
+        if prefix and self._prefixes.get(prefix, ns) == ns:
+            self._declareNamespace(prefix, ns)
+            return prefix
+
+        prefix = self._typePrefixes.get(ns)
+        if prefix is None:
+            prefix = "t%i" % len(self._typePrefixes)
+            while prefix in self._prefixes:
+                prefix = "t" + prefix
+            self._typePrefixes[ns] = prefix
+            self._declareNamespace(prefix, ns)
+        return prefix
+
+    def addTypes(self, types):
+        if types is not None and len(types) > 0:
+            typeList = [self._getTypePrefix(type) + ":" + type.getLocalname() for type in types]
+            self.addText("d:Types", " ".join(typeList))
+
+    def addScopes(self, scopes):
+        if scopes is not None and len(scopes) > 0:
+            attrs = ()
+            if scopes[0].getMatchBy() is not None and len(scopes[0].getMatchBy()) > 0:
+                attrs = (("MatchBy", scopes[0].getMatchBy()),)
+            self.addText("d:Scopes", " ".join([x.getQuotedValue() for x in scopes]), attrs)
+
+    def addXAddrs(self, xAddrs):
+        if xAddrs is not None:
+            self.addText("d:XAddrs", " ".join(xAddrs))
+
+    def getMessage(self):
+        "return the serialized message"
+        namespaces = "".join(" xmlns:%s=%s" % (prefix, quoteattr(ns)) for prefix, ns in self._namespaces)
+        return '<?xml version="1.0" encoding="utf-8"?>' \
+               '<s:Envelope%s><s:Header>%s</s:Header><s:Body>%s</s:Body></s:Envelope>' % \
+               (namespaces, "".join(self._header), "".join(self._body))
 
 
 def extractSoapUdpAddressFromURI(uri):
@@ -131,52 +114,54 @@ def extractSoapUdpAddressFromURI(uri):
     return addr
 
 
-def getXAddrs(xAddrsNode):
-    return _parseSpaceSeparatedList(xAddrsNode)
+MATCH_BY_LDAP = "http://schemas.xmlsoap.org/ws/2005/04/discovery/ldap"
+MATCH_BY_URI = "http://schemas.xmlsoap.org/ws/2005/04/discovery/rfc2396"
+MATCH_BY_UUID = "http://schemas.xmlsoap.org/ws/2005/04/discovery/uuid"
+MATCH_BY_STRCMP = "http://schemas.xmlsoap.org/ws/2005/04/discovery/strcmp0"
 
+# scope matching rules implemented by URI prefix matching
+MATCH_BY_URI_RULES = (MATCH_BY_LDAP, MATCH_BY_URI, MATCH_BY_UUID)
 
-def getTypes(typeNode):
-    return [getQNameFromValue(item, typeNode) \
-                for item in _parseSpaceSeparatedList(typeNode)]
 
+# upper limit for the number of parsed scopes & compiled scope matchers kept
+SCOPE_CACHE_SIZE = 4096
 
-def getScopes(scopeNode):
-    matchBy = scopeNode.getAttribute("MatchBy")
-    return [Scope(item, matchBy) \
-                for item in _parseSpaceSeparatedList(scopeNode)]
 
+@functools.lru_cache(maxsize=SCOPE_CACHE_SIZE)
+def parseScopeURI(value):
+    "parse a scope URI into a normalized (scheme, authority, path) tuple"
+    uri = URI(value)
+    return uri.getScheme().lower(), uri.getAuthority().lower(), uri.getPathExQueryFragment()
 
-def matchScope(src, target, matchBy):
 
-    MATCH_BY_LDAP = "http://schemas.xmlsoap.org/ws/2005/04/discovery/ldap"
-    MATCH_BY_URI = "http://schemas.xmlsoap.org/ws/2005/04/discovery/rfc2396"
-    MATCH_BY_UUID = "http://schemas.xmlsoap.org/ws/2005/04/discovery/uuid"
-    MATCH_BY_STRCMP = "http://schemas.xmlsoap.org/ws/2005/04/discovery/strcmp0"
-
-    if matchBy == "" or matchBy == None or matchBy == MATCH_BY_LDAP or matchBy == MATCH_BY_URI or matchBy == MATCH_BY_UUID:
-        src = URI(src)
-        target = URI(target)
-        if src.getScheme().lower() != target.getScheme().lower():
-            return False
-        if src.getAuthority().lower() != target.getAuthority().lower():
-            return False
-        srcPath = src.getPathExQueryFragment()
-        targetPath = target.getPathExQueryFragment()
-        if srcPath == targetPath:
-            return True
-        elif targetPath.startswith(srcPath):
-            n = len(srcPath)
-            if targetPath[n - 1] == srcPath[n - 1] == '/':
-                return True
-            if targetPath[n] == '/':
+@functools.lru_cache(maxsize=SCOPE_CACHE_SIZE)
+def compileScopeMatcher(src, matchBy):
+    "get a function that tells whether a target scope value matches SRC by the MATCHBY rule"
+
+    if matchBy == "" or matchBy == None or matchBy in MATCH_BY_URI_RULES:
+        scheme, authority, srcPath = parseScopeURI(src)
+        n = len(srcPath)
+        srcIsDir = srcPath.endswith('/')
+
+        def matchURI(target):
+            targetScheme, targetAuthority, targetPath = parseScopeURI(target)
+            if targetScheme != scheme or targetAuthority != authority:
+                return False
+            if targetPath == srcPath:
                 return True
-            return False
-        else:
-            return False
+            elif targetPath.startswith(srcPath):
+                return srcIsDir or targetPath[n] == '/'
+            else:
+                return False
+        return matchURI
     elif matchBy == MATCH_BY_STRCMP:
-        return src == target
+        return lambda target: target == src
     else:
-        return False
+        return lambda target: False
+
+
+def matchScope(src, target, matchBy):
+    return compileScopeMatcher(src, matchBy)(target)
 
 
 def isTypeInList(ttype, types):
@@ -187,8 +172,9 @@ def isTypeInList(ttype, types):
 
 
 def isScopeInList(scope, scopes):
+    match = compileScopeMatcher(scope.getValue(), scope.getMatchBy())
     for entry in scopes:
-        if matchScope(scope.getValue(), entry.getValue(), scope.getMatchBy()):
+        if match(entry.getValue()):
             return True
     return False
 
@@ -209,40 +195,6 @@ def filterServices(services, types, scopes):
     return [service for service in services if matchesFilter(service, types, scopes)]
 
 
-def getNamespaceValue(node, prefix):
-    while node != None:
-        if node.nodeType == minidom.Node.ELEMENT_NODE:
-            attr = node.getAttributeNode("xmlns:" + prefix)
-            if attr != None:
-                return attr.nodeValue
-        node = node.parentNode
-    return ""
-
-
-def getDefaultNamespace(node):
-    while node != None:
-        if node.nodeType == minidom.Node.ELEMENT_NODE:
-            attr = node.getAttributeNode("xmlns")
-            if attr != None:
-                return attr.nodeValue
-        node = node.parentNode
-    return ""
-
-
-def getQNameFromValue(value, node):
-    vals = value.split(":")
-    ns = ""
-    prefix = None
-    if len(vals) == 1:
-        localName = vals[0]
-        ns = getDefaultNamespace(node)
-    else:
-        localName = vals[1]
-        prefix = vals[0]
-        ns = getNamespaceValue(node, prefix)
-    return QName(ns, localName, prefix)
-
-
 def _getNetworkAddrs():
     result = []
 
@@ -256,12 +208,37 @@ def _getNetworkAddrs():
     return result
 
 
-def _generateInstanceId():
-    return str(random.randint(1, 0xFFFFFFFF))
+def _getNetworkAddrs6():
+    "get the local IPv6 addresses; link-local ones include their zone, e.g. fe80::1%eth0"
+    result = []
+
+    for if_name in netifaces.interfaces():
+        for addrDict in netifaces.ifaddresses(if_name).get(netifaces.AF_INET6, []):
+            addr = addrDict['addr']
+            if addr == '::1':
+                continue
+            if addr.lower().startswith('fe80:') and '%' not in addr:
+                addr += '%' + if_name
+            result.append(addr)
+    return result
+
 
+def _getInterfaceIndex(addr):
+    "get the index of the network interface with the given local address, or None if there is none"
+    host, _, zone = addr.partition('%')
+    for if_name in netifaces.interfaces():
+        if zone and zone != if_name:
+            continue
+        iface_info = netifaces.ifaddresses(if_name)
+        for family in (netifaces.AF_INET, netifaces.AF_INET6):
+            for addrDict in iface_info.get(family, []):
+                if addrDict['addr'].partition('%')[0] == host:
+                    return socket.if_nametoindex(if_name)
+    return None
 
-def getRandomStr():
-    return "".join([random.choice(string.ascii_letters) for x in range(10)])
+
+def _generateInstanceId():
+    return str(random.randint(1, 0xFFFFFFFF))
 
 
 def showEnv(env):